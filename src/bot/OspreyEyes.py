@@ -4,13 +4,19 @@ from discord.ext import commands
 import tracemalloc
 from dotenv import load_dotenv
 import os
-from flask import Flask, request
-from threading import Thread
-from pymongo import MongoClient
+from aiohttp import web
 import asyncio
 import logging
 import sys
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from shared.eventLog import EventLogReader
+from notificationQueues import NotificationQueues
+from discordDispatcher import DiscordDispatcher
+from shared.configCache import AsyncConfigCache, DEFAULT_CONFIG
+from shared import async_http_client
+from database import Database
+
 load_dotenv()
 BOT_TOKEN = os.getenv('DISCORD_TOKEN')
 DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
@@ -18,7 +24,6 @@ DATABASE_NAME = os.getenv('DATABASE_NAME')
 DATABASE_IP = os.getenv('DATABASE_IP')
 DATABASE_USER = os.getenv('DATABASE_USER')
 mongodbURI = f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
-mongoDBClient = MongoClient(mongodbURI) # sets up database client
 
 class MindsEyeBot(commands.Bot):
     def __init__(self, botToken):
@@ -33,57 +38,71 @@ class MindsEyeBot(commands.Bot):
         intents.message_content = True
         super().__init__(command_prefix='=', intents=intents)
 
-        self.flaskApp = Flask(__name__)
-        self.flaskApp.logger.handlers = self.logger.handlers
-        self.flaskApp.logger.setLevel(self.logger.level)
+        # event receiver served on the bot's own event loop
+        self.webApp = web.Application()
+        self.webRunner = None
+        self.EVENT_TYPES = ("aircraft-change", "new-account", "callsign-change")
+        self.EVENT_SETTINGS = {"aircraft-change": "displayAircraftChanges", "new-account": "displayNewAccounts", "callsign-change": "displayCallsignChanges"}
 
-        werkzeug_logger = logging.getLogger('werkzeug')
-        werkzeug_logger.handlers.clear()
-        werkzeug_logger.propagate = False
-        werkzeug_logger.setLevel(self.logger.level)
-        werkzeug_logger.addHandler(console_handler)
+        # durable event log written by the collector, read from a persisted offset
+        self.eventLog = EventLogReader()
+        self.EVENT_LOG_BATCH_SIZE = 500
+        self.EVENT_LOG_POLL_INTERVAL = 0.5
+        self.EVENT_LOG_STALL_WARNING = 60 # seconds a batch may take to be delivered before it is reported
 
         # sets up the event loop
 
-        self.throttleInterval = 0.2
-        self.task_queue = asyncio.Queue()
+        # lower priority numbers are served first, weights share turns between types of equal priority
+        self.QUEUE_SETTINGS = {
+            "mention": {"priority": 0, "weight": 1, "max_depth": 10},
+            "new-account": {"priority": 1, "weight": 2, "max_depth": 400},
+            "callsign-change": {"priority": 1, "weight": 1, "max_depth": 400},
+            "aircraft-change": {"priority": 2, "weight": 1, "max_depth": 400},
+        }
+        self.QUEUE_REPORT_INTERVAL = 600
+        self.task_queue = NotificationQueues(self.QUEUE_SETTINGS)
 
-        self.lock = asyncio.Lock()
-        self.config = self.load_config()
+        self.dispatcher = DiscordDispatcher(self.logger)
+        # one connection pool shared by the bot and every cog
+        self.db = Database(mongodbURI, DATABASE_NAME)
+        self.configCache = AsyncConfigCache(self.db.configurations)
+        self.configCache.add_listener(self.on_config_change)
         self.setup_routes()
 
-    def load_config(self):
-        return mongoDBClient[DATABASE_NAME]["configurations"].find_one()
-    
-    async def monitor_config(self): # monitors the configuration for changes
+    @property
+    def config(self): # cached configurations document, the defaults until it was loaded
+        return self.configCache.config or DEFAULT_CONFIG
+
+    def on_config_change(self, config, changed):
+        for key, value in changed.items():
+            self.logger.log(20, f"Configuration setting {key} changed to {value}")
+
+    def event_enabled(self, event_type): # disabled types are dropped before they are queued
+        setting = self.EVENT_SETTINGS.get(event_type)
+        return setting is None or self.config.get(setting, True)
+
+    async def report_queues(self): # logs depth and wait time of every notification queue, the dispatcher, the Mongo pool and GeoFS requests
         while True:
-            new_config = self.load_config()
-            if new_config:
-                if not new_config.get("displayAircraftChanges", True):
-                    await self.clear_queue_for_event("aircraft-change")
-                if not new_config.get("displayNewAccounts", True):
-                    await self.clear_queue_for_event("new-account")
-                if not new_config.get("displayCallsignChanges", True):
-                    await self.clear_queue_for_event("callsign-change")
-            await asyncio.sleep(5)
-
-    async def clear_queue_for_event(self, event_type):
-        new_queue = asyncio.Queue()
-
-        # iterate through the queue and put all events that are not the specified type into the new queue
-        while not self.task_queue.empty():
-            task_type, data = await self.task_queue.get()
-            if task_type != event_type:
-                await new_queue.put((task_type, data))
-            self.task_queue.task_done()
-        
-        self.task_queue = new_queue
+            await asyncio.sleep(self.QUEUE_REPORT_INTERVAL)
+            for task_type, stats in self.task_queue.stats().items():
+                self.logger.log(20, f"Queue {task_type}: depth {stats['depth']}, {stats['enqueued']} queued, {stats['dropped']} dropped, {stats['served']} served, wait mean {stats['mean_wait_ms']}ms max {stats['max_wait_ms']}ms")
+            stats = self.dispatcher.stats()
+            self.logger.log(20, f"Dispatcher: backlog {stats['backlog']} embeds over {stats['channels']} channels, {stats['messages']} messages, {stats['embeds']} embeds sent, {stats['digested']} digested, {stats['failed']} failed")
+            stats = self.db.poolMetrics.stats()
+            self.logger.log(20, f"Mongo pool: {stats['open']} open, {stats['checked_out']} checked out, {stats['checkouts']} checkouts, {stats['failed_checkouts']} failed, wait p50 {stats['p50_wait_ms']}ms p95 {stats['p95_wait_ms']}ms max {stats['max_wait_ms']}ms")
+            stats = async_http_client.metrics.stats()
+            self.logger.log(20, f"GeoFS HTTP: {stats['requests']} requests, {stats['reused']} reused, {stats['connections']} connections, {stats['retries']} retries, {stats['gave_up']} gave up, {stats['short_circuited']} short circuited, p50/p95 dns {stats['p50_dns_ms']}/{stats['p95_dns_ms']}ms connect {stats['p50_connect_ms']}/{stats['p95_connect_ms']}ms ttfb {stats['p50_ttfb_ms']}/{stats['p95_ttfb_ms']}ms")
 
     async def on_ready(self):
         self.logger.log(20, f'{self.user} has connected to Discord!')
     
     async def setup_hook(self) -> None:
         self.logger.log(20, "Starting up...")
+        self.logger.log(20, "Loading configuration...")
+        try:
+            await self.configCache.load()
+        except Exception as e:
+            self.logger.log(40, f"Failed to load the configuration, using defaults until it is reachable. Error: {e}")
         self.logger.log(20, "Loading extensions...")
         await self._load_extensions()
         self.logger.log(20, "Syncing commands...")
@@ -93,59 +112,145 @@ class MindsEyeBot(commands.Bot):
         except Exception as e:
             self.logger.log(40, f"Exception while syncing commands. Error: {e}")
 
-        self.logger.log(20, "Launching Flask server...")
-        Thread(target=self.flaskApp.run, kwargs={"host": "127.0.0.1", "port": 5001}).start()
+        self.logger.log(20, "Launching event receiver...")
+        self.webRunner = web.AppRunner(self.webApp, access_log=None, keepalive_timeout=75)
+        await self.webRunner.setup()
+        await web.TCPSite(self.webRunner, "127.0.0.1", 5001).start()
         self.logger.log(20, "Connecting to discord...")
 
         self.logger.log(20, "Starting task processing loops...")
-        self.loop.create_task(self.process_tasks())
-        self.loop.create_task(self.monitor_config())
+        self.start_supervised("Task processing", self.process_tasks)
+        self.loop.create_task(self.configCache.run()) # change stream, or a version poll every second
+        self.start_supervised("Event log tail", self.tail_event_log)
+        self.loop.create_task(self.report_queues())
+
+    def start_supervised(self, name, loop_function): # runs a loop as a task and restarts it a second after it dies
+        task = self.loop.create_task(loop_function())
+
+        def on_done(task):
+            if task.cancelled():
+                return
+            self.logger.log(40, f"{name} stopped, restarting it. Error: {task.exception()!r}")
+            self.loop.call_later(1, self.start_supervised, name, loop_function)
+
+        task.add_done_callback(on_done)
+        return task
 
     def setup_routes(self):
-        @self.flaskApp.route("/bot-mention", methods=["POST"])
-        def bot_mention():
-            asyncio.run_coroutine_threadsafe(self.task_queue.put(("mention", None)), self.loop)
-            return "", 204
-        @self.flaskApp.route("/aircraft-change", methods=["POST"])
-        def aircraft_change():
-            data = request.json
-            if not isinstance(data, list):
-                return 'Invalid data format. Expected a list.', 400
-            asyncio.run_coroutine_threadsafe(self.task_queue.put(("aircraft-change", data)), self.loop)
-            return "", 204
-        @self.flaskApp.route("/new-account", methods=["POST"])
-        def new_account():
-            data = request.json
-            if not isinstance(data, list):
-                return 'Invalid data format. Expected a list.', 400
-            asyncio.run_coroutine_threadsafe(self.task_queue.put(("new-account", data)), self.loop)
-            return "", 204
-        @self.flaskApp.route("/callsign-change", methods=["POST"])
-        def callsign_change():
-            data = request.json
+        self.webApp.add_routes([web.post("/bot-mention", self.receive_mention), web.post("/events", self.receive_events)])
+        for event_type in self.EVENT_TYPES:
+            self.webApp.router.add_post(f"/{event_type}", self.make_receiver(event_type))
+
+    def enqueue_task(self, task_type, data): # queues a batch, answering 503 when the bot is behind so the sender backs off
+        if not self.event_enabled(task_type):
+            self.task_queue.drop(task_type)
+            return web.Response(status=204)
+        try:
+            self.task_queue.put_nowait(task_type, data)
+        except asyncio.QueueFull:
+            return web.Response(status=503, headers={"Retry-After": "1"}, text="Event queue is full.")
+        return web.Response(status=204)
+
+    async def receive_mention(self, request):
+        return self.enqueue_task("mention", None)
+
+    def make_receiver(self, event_type): # receiver for a list of events of one type
+        async def receive(request):
+            try:
+                data = await request.json()
+            except ValueError:
+                return web.Response(status=400, text="Invalid JSON.")
             if not isinstance(data, list):
-                return 'Invalid data format. Expected a list.', 400
-            asyncio.run_coroutine_threadsafe(self.task_queue.put(("callsign-change", data)), self.loop)
-            return "", 204
+                return web.Response(status=400, text="Invalid data format. Expected a list.")
+            return self.enqueue_task(event_type, data)
+        return receive
+
+    async def receive_events(self, request): # batch-aware receiver: [{"type": ..., "data": {...}}, ...] of mixed types
+        try:
+            events = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON.")
+        if not isinstance(events, list):
+            return web.Response(status=400, text="Invalid data format. Expected a list.")
+        batches = {}
+        for event in events:
+            if not isinstance(event, dict) or event.get("type") not in self.EVENT_TYPES:
+                return web.Response(status=400, text="Invalid event. Expected {\"type\": ..., \"data\": ...}.")
+            batches.setdefault(event["type"], []).append(event.get("data"))
+        for event_type in list(batches):
+            if not self.event_enabled(event_type):
+                self.task_queue.drop(event_type)
+                del batches[event_type]
+        if any(self.task_queue.free(event_type) < 1 for event_type in batches):
+            return web.Response(status=503, headers={"Retry-After": "1"}, text="Event queue is full.")
+        for event_type, data in batches.items():
+            self.task_queue.put_nowait(event_type, data)
+        return web.Response(status=204)
+
+    async def tail_event_log(self): # feeds the task queue from the event log, committing the offset once a batch is handled
+        while True:
+            try:
+                events, offset = await asyncio.to_thread(self.eventLog.read_batch, self.EVENT_LOG_BATCH_SIZE)
+            except OSError as e:
+                self.logger.log(40, f"Failed to read the event log. Error: {e}")
+                await asyncio.sleep(5)
+                continue
+            if not events:
+                await asyncio.sleep(self.EVENT_LOG_POLL_INTERVAL)
+                continue
+
+            batches = {}
+            for event in events:
+                event_type = event.get("type")
+                if event_type == "bot-mention":
+                    await self.task_queue.put("mention", None)
+                elif event_type not in self.EVENT_TYPES:
+                    continue
+                elif not self.event_enabled(event_type):
+                    self.task_queue.drop(event_type)
+                else:
+                    batches.setdefault(event_type, []).append(event.get("data"))
+            for event_type, data in batches.items():
+                await self.task_queue.put(event_type, data)
+
+            # the offset only moves past events that were sent, a restart replays the rest
+            waited = 0
+            while True:
+                try:
+                    await asyncio.wait_for(self.batch_delivered(), timeout=self.EVENT_LOG_STALL_WARNING)
+                    break
+                except asyncio.TimeoutError:
+                    waited += self.EVENT_LOG_STALL_WARNING
+                    self.logger.log(30, f"Event log batch not delivered after {waited}s, {self.task_queue.unfinished} tasks and {self.dispatcher.stats()['backlog']} embeds outstanding.")
+            await asyncio.to_thread(self.eventLog.commit, offset)
+
+    async def batch_delivered(self): # returns once every queued task was processed and its embeds sent
+        await self.task_queue.join()
+        await self.dispatcher.join()
 
     async def process_tasks(self):
         # process tasks from the queue
         while True:
             task_type, data = await self.task_queue.get()
-            if task_type == "mention":
-                await self.send_bot_mention()
-            elif task_type == "aircraft-change":
-                await self.process_aircraft_change(data)
-            elif task_type == "new-account":
-                await self.process_new_account(data)
-            elif task_type == "callsign-change":
-                await self.process_callsign_change(data)
-            self.task_queue.task_done()
+            try:
+                if task_type == "mention":
+                    await self.send_bot_mention()
+                elif task_type == "aircraft-change":
+                    await self.process_aircraft_change(data)
+                elif task_type == "new-account":
+                    await self.process_new_account(data)
+                elif task_type == "callsign-change":
+                    await self.process_callsign_change(data)
+            except Exception as e:
+                self.logger.log(40, f"Failed to process {task_type} task. Error: {e}")
+            finally: # the event log tail waits on join() before committing its offset
+                self.task_queue.task_done()
 
     async def send_bot_mention(self):
         chat_logger = self.get_cog("chatLogging")
         if chat_logger:
-            await chat_logger.automatedSendMessage("Nothing can hide from the all seeing eye.")
+            if not await chat_logger.automatedSendMessage("Nothing can hide from the all seeing eye."):
+                self.logger.log(30, "Could not answer a bot mention, GeoFS multiplayer is unreachable.")
     
     async def process_aircraft_change(self, data):
         channel = self.get_channel_config("aircraft-change")
@@ -189,11 +294,8 @@ class MindsEyeBot(commands.Bot):
         ]
         await self.send_embeds(channel, embeds)
     
-    async def send_embeds(self, channel, embeds):
-        async with self.lock:
-            for embed in embeds:
-                await channel.send(embed=embed)
-                await asyncio.sleep(self.throttleInterval)
+    async def send_embeds(self, channel, embeds): # hands embeds to the channel's dispatcher worker
+        self.dispatcher.send(channel, embeds)
 
     def get_channel_config(self, event_type): # gets the channel for the event type
         if event_type == "aircraft-change":
@@ -211,25 +313,36 @@ class MindsEyeBot(commands.Bot):
             return None
         return channel
         
+    async def close(self):
+        if self.webRunner:
+            await self.webRunner.cleanup()
+        await self.dispatcher.close()
+        await async_http_client.close_session()
+        self.db.close()
+        await super().close()
+
     async def _load_extensions(self) -> None:
         for extension in ("chatLogging", "playerTracking", "mrpTracking", "config",):
             await self.load_extension(f"cogs.{extension}")
 
-bot = MindsEyeBot(BOT_TOKEN)
+def create_bot() -> MindsEyeBot: # only called from main, heatmap render workers import this module without starting a bot
+    bot = MindsEyeBot(BOT_TOKEN)
+
+    @bot.event
+    async def on_guild_join(guild):
+        async for entry in guild.audit_logs(action=discord.AuditLogAction.bot_add):
+            bot.logger.log(20, f"Joined {guild.name}")
 
-@bot.event
-async def on_guild_join(guild):
-    async for entry in guild.audit_logs(action=discord.AuditLogAction.bot_add):
-        bot.logger.log(20, f"Joined {guild.name}")
+    @bot.tree.command(name="ping", description="Check bot connection and latency.")
+    async def ping(interaction: discord.Interaction):
+        delay = round(bot.latency * 1000)
+        embed = discord.Embed(title="Pong!", description=f"Latency: {delay}ms", color=discord.Color.green())
+        await interaction.response.send_message(embed=embed)
 
-@bot.tree.command(name="ping", description="Check bot connection and latency.")
-async def ping(interaction: discord.Interaction):
-    delay = round(bot.latency * 1000)
-    embed = discord.Embed(title="Pong!", description=f"Latency: {delay}ms", color=discord.Color.green())
-    await interaction.response.send_message(embed=embed)
+    return bot
 
 def main():
-    bot.run(BOT_TOKEN)
+    create_bot().run(BOT_TOKEN)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
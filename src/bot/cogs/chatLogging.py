@@ -17,19 +17,19 @@ class ChatLogger(commands.Cog):
         self.bot = bot
         SESSION_ID = os.getenv('GEOFS_SESSION_ID')
         ACCOUNT_ID = os.getenv('GEOFS_ACCOUNT_ID')
-        self.multiplayerAPI = multiplayerAPI.MultiplayerAPI(SESSION_ID, ACCOUNT_ID) # sets up multiplayer API
+        self.multiplayerAPI = multiplayerAPI.AsyncMultiplayerAPI(SESSION_ID, ACCOUNT_ID) # sets up multiplayer API
 
     chatGroup = app_commands.Group(name="chat", description="Commands for logging chat messages.") # sets up command group
 
-    async def automatedSendMessage(self, message):
-        self.multiplayerAPI.handshake()
-        self.multiplayerAPI.sendMsg(message)
+    async def automatedSendMessage(self, message): # returns whether the message was sent
+        return await self.multiplayerAPI.send(message)
 
     @chatGroup.command(name="send_chat_message", description="Send a chat message to the geofs chat.")
     async def sendChatMessage(self, interaction: discord.Interaction, message: str): # sends a chat message to geofs chat
         await interaction.response.defer()
-        self.multiplayerAPI.handshake()
-        self.multiplayerAPI.sendMsg(message)
+        if not await self.multiplayerAPI.send(message):
+            await interaction.followup.send("Could not reach GeoFS multiplayer, the message was not sent.")
+            return
         await interaction.followup.send(f"Sent message: {message}")
 
 async def setup(bot: MindsEyeBot):
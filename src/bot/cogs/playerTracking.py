@@ -1,36 +1,30 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import numpy as np
 import io
-from scipy.ndimage import gaussian_filter
-from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
 import os
 import sys
 from datetime import datetime, timedelta
-from collections import defaultdict
 from OspreyEyes import MindsEyeBot
 from paginationEmbed import PaginatedEmbed
+from heatmapRenderer import HeatmapRenderer
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from shared import mapAPI
+from shared import mapAPI, heatmapGrid
 
 class PlayerTracker(commands.Cog):
     def __init__(self, bot):
-        # gets envs
-        load_dotenv()
         self.bot = bot
-        self.DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
-        self.DATABASE_NAME = os.getenv('DATABASE_NAME')
-        DATABASE_IP = os.getenv('DATABASE_IP')
-        DATABASE_USER = os.getenv('DATABASE_USER')
-        self.mapAPI = mapAPI.MapAPI()
+        self.db = bot.db
+        self.mapAPI = mapAPI.AsyncMapAPI()
         self.mapAPI.disableResponseList()
-        mongodbURI = f"mongodb://{DATABASE_USER}:{self.DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={self.DATABASE_NAME}"
-        self.mongoDBClient = AsyncIOMotorClient(mongodbURI) # sets up database client
+        self.renderer = HeatmapRenderer()
+
+    async def cog_load(self):
+        self.renderer.warm()
+
+    async def cog_unload(self):
+        self.renderer.close()
 
     playersGroup = app_commands.Group(name="players", description="Commands for tracking player activity.") # creates a the player commands group
 
@@ -38,51 +32,65 @@ class PlayerTracker(commands.Cog):
     async def getOnlineUsers(self, interaction: discord.Interaction): # gets the online users from the map API
         await interaction.response.defer()
         stringifiedUsers = []
-        currentOnlineUsers = self.mapAPI.getUsers(False)
+        currentOnlineUsers = await self.mapAPI.getUsers(False)
+        if currentOnlineUsers is None:
+            await interaction.followup.send("Could not reach the GeoFS map, try again later.")
+            return
         for user in currentOnlineUsers:
-            stringifiedUsers.append(f"Callsign: {user.userInfo["callsign"]}, Account ID: {user.userInfo["id"]} Latitude: {user.coordinates[0]}, Longitude: {user.coordinates[1]} Aircraft: {user.aircraft["type"]}")
+            stringifiedUsers.append(f"Callsign: {user.userInfo['callsign']}, Account ID: {user.userInfo['id']} Latitude: {user.coordinates[0]}, Longitude: {user.coordinates[1]} Aircraft: {user.aircraft['type']}")
         embed = PaginatedEmbed(stringifiedUsers, title="Online Users", description="List of online users.")
         await interaction.followup.send(embed=embed.embed, view=embed) # sends the online users in a paginated embed
 
     @playersGroup.command(name="generate_player_heatmap", description="Generate a heatmap of player activity locations.")
-    async def heatmap(self, interaction: discord.Interaction): # generates a heatmap of player activity locations
+    async def heatmap(self, interaction: discord.Interaction, days: int = 0, region: str = None, west: float = None, south: float = None, east: float = None, north: float = None): # generates a heatmap of player activity locations, over the last days or all time when 0
         await interaction.response.defer()
 
-        db = self.mongoDBClient[self.DATABASE_NAME]
-        collection = db["player_locations"]
-        cursor = collection.find()
-        # get the latitudes and longitudes from the database
-        data = await cursor.to_list(length=None)
-        latitudes = [doc["latitude"] for doc in data]
-        longitudes = [doc["longitude"] for doc in data]
-
-
-        # set up the map
-        fig, ax = plt.subplots(figsize=(10, 10), subplot_kw={"projection": ccrs.PlateCarree()})
-        ax.coastlines()
-        ax.set_global()
-        ax.set_extent([-180, 180, -90, 90], crs=ccrs.PlateCarree())
-
-        heatmap, xedges, yedges = np.histogram2d(
-            longitudes,
-            latitudes,
-            bins=100,
-            range=[[-180, 180], [-90, 90]],
-        )
-
-        heatmap = gaussian_filter(heatmap, sigma=1) # smoozes the colors
-
-        extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
-        ax.imshow(heatmap.T, extent=extent, origin="lower", cmap="viridis", alpha=0.6)
-
-        # save the figure to a BytesIO object
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, dpi=150)
-        buf.seek(0)
-
+        # the area is a named region, a box, or the whole world
+        if region:
+            bbox = await self.db.get_heatmap_region(region)
+            if bbox is None:
+                regions = ", ".join(r["name"] for r in await self.db.list_heatmap_regions()) or "none"
+                await interaction.followup.send(f"Unknown region {region}. Available regions: {regions}")
+                return
+        elif None not in (west, south, east, north):
+            bbox = (west, south, east, north)
+        else:
+            bbox = heatmapGrid.WORLD
+        error = heatmapGrid.validate_bbox(bbox)
+        if error:
+            await interaction.followup.send(error)
+            return
+        level = heatmapGrid.level_for(bbox)
+
+        # renders are cached per window, area and heatmap version, a hit only reads the version
+        since = heatmapGrid.day_bucket(datetime.now() - timedelta(days=days - 1)) if days > 0 else None
+        key = (since, bbox, await self.db.heatmap_version())
+        png = self.renderer.cached(key)
+        if png is None:
+            x, y, counts = await self.db.heatmap_cells(level, bbox, since)
+            png = await self.renderer.render(key, x, y, counts, level, bbox)
+
+        buf = io.BytesIO(png)
         await interaction.followup.send(file=discord.File(buf, "heatmap.png"))
         buf.close()
 
+    @playersGroup.command(name="set_heatmap_region", description="Save a named bounding box for regional heatmaps.")
+    async def setHeatmapRegion(self, interaction: discord.Interaction, name: str, west: float, south: float, east: float, north: float):
+        bbox = (west, south, east, north)
+        error = heatmapGrid.validate_bbox(bbox)
+        if error:
+            await interaction.response.send_message(error)
+            return
+        await self.db.set_heatmap_region(name, bbox)
+        await interaction.response.send_message(f"Heatmap region {name} set to west {west}, south {south}, east {east}, north {north}.")
+
+    @playersGroup.command(name="remove_heatmap_region", description="Remove a named heatmap region.")
+    async def removeHeatmapRegion(self, interaction: discord.Interaction, name: str):
+        if await self.db.remove_heatmap_region(name):
+            await interaction.response.send_message(f"Heatmap region {name} removed.")
+        else:
+            await interaction.response.send_message(f"There is no heatmap region named {name}.")
+
     @playersGroup.command(name="get_aircraft_distributions", description="Get the distribution of aircraft types in relation to a specific date.")
     @app_commands.choices(time_span=[
         app_commands.Choice(name="before", value="before"),
@@ -97,39 +105,61 @@ class PlayerTracker(commands.Cog):
             try:
                 targetDate = datetime(year, month, day)
             except ValueError:
-                await interaction.response.send_message("Invalid date.")
+                await interaction.followup.send("Invalid date.")
                 return
 
-        db = self.mongoDBClient[self.DATABASE_NAME]
-        collection = db["aircraft"]
-
-        # filter the documents based on the time span
+        # filter the daily rollups based on the time span
         if time_span.value == "before":
-            documents = collection.find({"datetime": {"$lt": targetDate}})
+            samples, totals = await self.db.aircraft_distribution({"$lt": targetDate})
         elif time_span.value == "after":
-            documents = collection.find({"datetime": {"$gt": targetDate}})
+            samples, totals = await self.db.aircraft_distribution({"$gte": targetDate})
         elif time_span.value == "on":
-            next_day = targetDate + timedelta(days=1)
-            documents = collection.find({"datetime": {"$gte": targetDate, "$lt": next_day}})
+            samples, totals = await self.db.aircraft_distribution({"$eq": targetDate})
         elif time_span.value == "all":
-            documents = collection.find()
-
-        aircraftTotals = defaultdict(int)
-        aircraftCounts = defaultdict(int)
+            samples, totals = await self.db.aircraft_distribution()
 
-        # calculate the totals
-        async for document in documents:
-            for aircraft, count in document["aircraft"].items():
-                aircraftTotals[aircraft] += count
-                aircraftCounts[aircraft] += 1
-        aircraftAverages = {aircraft: (aircraftTotals[aircraft] / aircraftCounts[aircraft]) for aircraft in aircraftTotals}
+        # average number of pilots flying each aircraft, rollups are keyed by aircraft id
+        aircraftAverages = {}
+        for aircraftID, total in totals.items():
+            name = self.mapAPI.aircraft_codes.get(aircraftID, {}).get("name", f"Unknown ({aircraftID})")
+            aircraftAverages[name] = aircraftAverages.get(name, 0) + total / samples
 
-
-        # sort the totals
+        # sort the averages
         sortedAverages = sorted(aircraftAverages.items(), key=lambda x: x[1], reverse=True)
-        aircraftAverages = [f"**{aircraft}:** {count}" for aircraft, count in sortedAverages]
+        aircraftAverages = [f"**{aircraft}:** {round(count, 2)}" for aircraft, count in sortedAverages]
         embed = PaginatedEmbed(aircraftAverages, title="Aircraft Distributions")
         await interaction.followup.send(embed=embed.embed, view=embed)
 
+    @playersGroup.command(name="get_player_counts", description="Get the online player count over a range of days.")
+    @app_commands.choices(resolution=[
+        app_commands.Choice(name="minute", value="minute"),
+        app_commands.Choice(name="hour", value="hour"),
+        app_commands.Choice(name="day", value="day"),
+    ])
+    async def getPlayerCounts(self, interaction: discord.Interaction, resolution: app_commands.Choice[str], day: int, month: int, year: int, days: int = 1):
+        await interaction.response.defer()
+        # validate parameters
+        try:
+            start = datetime(year, month, day)
+        except ValueError:
+            await interaction.followup.send("Invalid date.")
+            return
+        maxDays = {"minute": 2, "hour": 62, "day": 3660}[resolution.value] # keeps the listing to a few thousand buckets
+        if not 1 <= days <= maxDays:
+            await interaction.followup.send(f"days must be between 1 and {maxDays} at {resolution.value} resolution.")
+            return
+
+        buckets = await self.db.player_counts(resolution.value, start, start + timedelta(days=days))
+        if not buckets:
+            await interaction.followup.send("No player counts were recorded in that range.")
+            return
+
+        timeFormat = "%Y-%m-%d" if resolution.value == "day" else "%Y-%m-%d %H:%M"
+        lines = [f"**{bucket['time'].strftime(timeFormat)}:** {round(bucket['mean'], 1)} (min {bucket['min']}, max {bucket['max']})" for bucket in buckets]
+        mean = sum(bucket["mean"] for bucket in buckets) / len(buckets)
+        title = f"Player Counts, mean {round(mean, 1)}, min {min(bucket['min'] for bucket in buckets)}, max {max(bucket['max'] for bucket in buckets)}"
+        embed = PaginatedEmbed(lines, title=title)
+        await interaction.followup.send(embed=embed.embed, view=embed)
+
 async def setup(bot: MindsEyeBot):
     await bot.add_cog(PlayerTracker(bot))
\ No newline at end of file
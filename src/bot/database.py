@@ -0,0 +1,187 @@
+from collections import deque
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from shared.configCache import VERSION_FIELD
+from shared import heatmapGrid
+from shared.timeBuckets import PERIODS, bucket_start, slot_start
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Connection pool listener recording open connections and how long
+    operations waited to check one out.
+    """
+    def __init__(self, samples=1000):
+        self.open = 0
+        self.checkedOut = 0
+        self.checkouts = 0
+        self.failedCheckouts = 0
+        self.waits = deque(maxlen=samples) # seconds spent waiting for a connection
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {
+            "open": self.open,
+            "checked_out": self.checkedOut,
+            "checkouts": self.checkouts,
+            "failed_checkouts": self.failedCheckouts,
+            "p50_wait_ms": round(waits[len(waits) // 2] * 1000, 2) if waits else 0,
+            "p95_wait_ms": round(waits[int(len(waits) * 0.95)] * 1000, 2) if waits else 0,
+            "max_wait_ms": round(waits[-1] * 1000, 2) if waits else 0,
+        }
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_checked_out(self, event):
+        self.checkouts += 1
+        self.checkedOut += 1
+        if getattr(event, "duration", None) is not None:
+            self.waits.append(event.duration)
+
+    def connection_checked_in(self, event):
+        self.checkedOut -= 1
+
+    def connection_check_out_failed(self, event):
+        self.failedCheckouts += 1
+        if getattr(event, "duration", None) is not None:
+            self.waits.append(event.duration)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+
+class Database:
+    """
+    The bot's only Mongo client and the queries its cogs run.
+
+    Every query asks only for the fields its caller uses. The pool is kept
+    small on purpose, the bot issues a handful of concurrent queries at most.
+    """
+    def __init__(self, uri: str, name: str, maxPoolSize: int = 10, minPoolSize: int = 1, maxIdleTimeMS: int = 60000, waitQueueTimeoutMS: int = 5000):
+        self.poolMetrics = PoolMetrics()
+        self.client = AsyncIOMotorClient(
+            uri,
+            maxPoolSize=maxPoolSize,
+            minPoolSize=minPoolSize,
+            maxIdleTimeMS=maxIdleTimeMS,
+            waitQueueTimeoutMS=waitQueueTimeoutMS,
+            event_listeners=[self.poolMetrics],
+        )
+        self.db = self.client[name]
+        self.configurations = self.db["configurations"]
+        self.forces = self.db["forces"]
+        self.patrolSessions = self.db["patrol_sessions"]
+        self.heatmapCells = self.db["heatmap_cells"]
+        self.heatmapMeta = self.db["heatmap_meta"]
+        self.heatmapRegions = self.db["heatmap_regions"]
+        self.aircraftRollups = self.db["aircraft_rollups"]
+        self.playerCounts = self.db["player_counts"]
+
+    def close(self):
+        self.client.close()
+
+    # forces
+
+    async def bump_forces_version(self) -> None: # tells the collector to recompile its force filters
+        await self.configurations.update_one({}, {"$inc": {"forcesVersion": 1, VERSION_FIELD: 1}})
+
+    async def add_force(self, name: str, callsign_filter: str) -> None:
+        await self.forces.insert_one({"callsign_filter": callsign_filter, "name": name})
+        await self.bump_forces_version()
+
+    async def remove_force(self, name: str) -> None:
+        await self.forces.delete_one({"name": name})
+        await self.bump_forces_version()
+
+    async def set_force_callsign_filter(self, name: str, callsign_filter: str) -> None:
+        await self.forces.update_one({"name": name}, {"$set": {"callsign_filter": callsign_filter}})
+        await self.bump_forces_version()
+
+    async def list_forces(self) -> list[dict]: # [{name, callsign_filter}]
+        return await self.forces.find({}, {"_id": 0, "name": 1, "callsign_filter": 1}).to_list(length=None)
+
+    # patrols
+
+    async def list_force_patrols(self, name: str, limit: int = 1000) -> list[dict]: # newest first, [{callsign, start_time, end_time, airborne_seconds}]
+        return await self.patrolSessions.find(
+            {"force": name},
+            {"_id": 0, "callsign": 1, "start_time": 1, "end_time": 1, "airborne_seconds": 1}
+        ).sort("start_time", -1).limit(limit).to_list(length=limit)
+
+    async def total_patrol_seconds(self, name: str, end_time: dict) -> float: # airborne seconds of the closed patrols matching end_time
+        result = await self.patrolSessions.aggregate([
+            {"$match": {"force": name, "end_time": end_time}},
+            {"$group": {"_id": None, "airborne_seconds": {"$sum": "$airborne_seconds"}}}
+        ]).to_list(length=1)
+        return result[0]["airborne_seconds"] if result else 0
+
+    # player data
+
+    async def heatmap_version(self) -> int: # bumped by the collector with every heatmap snapshot
+        meta = await self.heatmapMeta.find_one({"_id": "cells"}, {"version": 1})
+        return meta["version"] if meta else 0
+
+    async def heatmap_cells(self, level: int, bbox: tuple, since: datetime = None) -> tuple[list[int], list[int], list[int]]: # (x, y, count) of the occupied cells of a level inside the box since the given day, all time when None
+        match = {"level": level, "loc": heatmapGrid.bbox_query(bbox), **heatmapGrid.window_query(since)}
+        x = []
+        y = []
+        counts = []
+        async for cell in self.heatmapCells.aggregate([
+            {"$match": match},
+            {"$group": {"_id": {"x": "$x", "y": "$y"}, "count": {"$sum": "$count"}}}
+        ]):
+            x.append(cell["_id"]["x"])
+            y.append(cell["_id"]["y"])
+            counts.append(cell["count"])
+        return x, y, counts
+
+    async def set_heatmap_region(self, name: str, bbox: tuple) -> None:
+        await self.heatmapRegions.update_one({"name": name}, {"$set": {"bbox": list(bbox)}}, upsert=True)
+
+    async def remove_heatmap_region(self, name: str) -> bool:
+        result = await self.heatmapRegions.delete_one({"name": name})
+        return result.deleted_count > 0
+
+    async def get_heatmap_region(self, name: str) -> tuple | None: # (west, south, east, north)
+        region = await self.heatmapRegions.find_one({"name": name}, {"_id": 0, "bbox": 1})
+        return tuple(region["bbox"]) if region else None
+
+    async def list_heatmap_regions(self) -> list[dict]: # [{name, bbox}]
+        return await self.heatmapRegions.find({}, {"_id": 0, "name": 1, "bbox": 1}).to_list(length=None)
+
+    async def aircraft_distribution(self, bucket_filter: dict = None, resolution: str = "day") -> tuple[int, dict]: # (samples, {aircraft id: pilot ticks}) summed over the matching rollup buckets
+        match = {"resolution": resolution}
+        if bucket_filter:
+            match["bucket"] = bucket_filter
+        result = await self.aircraftRollups.aggregate([
+            {"$match": match},
+            {"$project": {"samples": 1, "counts": {"$objectToArray": "$counts"}}},
+            {"$facet": {
+                "samples": [{"$group": {"_id": None, "samples": {"$sum": "$samples"}}}],
+                "counts": [{"$unwind": "$counts"}, {"$group": {"_id": "$counts.k", "total": {"$sum": "$counts.v"}}}],
+            }}
+        ]).to_list(length=1)
+        if not result or not result[0]["samples"]:
+            return 0, {}
+        return result[0]["samples"][0]["samples"], {count["_id"]: count["total"] for count in result[0]["counts"]}
+
+    async def player_counts(self, resolution: str, start: datetime, end: datetime) -> list[dict]: # oldest first, [{time, min, max, mean}] for the buckets starting in [start, end)
+        buckets = []
+        async for document in self.playerCounts.find(
+            {"resolution": resolution, "period": {"$gte": bucket_start(start, PERIODS[resolution]), "$lt": end}},
+            {"_id": 0, "period": 1, "slots": 1}
+        ):
+            for slot, counts in document["slots"].items():
+                time = slot_start(document["period"], int(slot), resolution)
+                if start <= time < end:
+                    buckets.append({"time": time, "min": counts["min"], "max": counts["max"], "mean": counts["sum"] / counts["samples"]})
+        return sorted(buckets, key=lambda bucket: bucket["time"])
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from collections import deque, defaultdict
+import discord
+
+
+class DiscordDispatcher:
+    """
+    Sends notification embeds to Discord with one worker per channel.
+
+    Embeds are packed into as few messages as Discord allows (max_embeds per
+    message, max_chars of embed text in total) and every channel has its own
+    bucket of rate messages per per seconds, so channels are sent to in
+    parallel while each stays under its limit. When a channel's backlog has
+    stayed at digest_threshold embeds or more for digest_after seconds the
+    backlog is collapsed into digest embeds, one per title, instead of being
+    sent one by one; a single burst that drains in time is sent as usual.
+
+    send() only queues; join() waits until everything queued was delivered or
+    given up on. A worker that dies is logged and restarted, so join() does
+    not hang on a channel nobody is sending to.
+    """
+    def __init__(self, logger, max_embeds=10, max_chars=6000, rate=5, per=5, digest_threshold=50, digest_after=30, digest_chars=1800, max_retries=3):
+        self.logger = logger
+        self.max_embeds = max_embeds
+        self.max_chars = max_chars
+        self.rate = rate
+        self.per = per
+        self.digest_threshold = digest_threshold
+        self.digest_after = digest_after
+        self.digest_chars = digest_chars
+        self.max_retries = max_retries
+
+        self.pending = {} # channel id -> deque of embeds
+        self.wakeups = {} # channel id -> event set when embeds are queued
+        self.sent_times = defaultdict(deque) # channel id -> send times inside the current window
+        self.behind_since = {} # channel id -> when its backlog reached digest_threshold
+        self.workers = {}
+        self.unfinished = 0
+        self.all_done = asyncio.Event()
+        self.all_done.set()
+
+        self.messages = 0
+        self.embeds = 0
+        self.digested = 0
+        self.failed = 0
+
+    def send(self, channel, embeds): # queues embeds for a channel, starting its worker on first use
+        if not embeds:
+            return
+        if channel.id not in self.workers:
+            self.pending[channel.id] = deque()
+            self.wakeups[channel.id] = asyncio.Event()
+            self._start_worker(channel)
+        self.pending[channel.id].extend(embeds)
+        self.unfinished += len(embeds)
+        self.all_done.clear()
+        self.wakeups[channel.id].set()
+
+    async def join(self):
+        await self.all_done.wait()
+
+    def stats(self):
+        return {
+            "backlog": sum(len(pending) for pending in self.pending.values()),
+            "channels": len(self.workers),
+            "messages": self.messages,
+            "embeds": self.embeds,
+            "digested": self.digested,
+            "failed": self.failed,
+        }
+
+    async def close(self):
+        for worker in self.workers.values():
+            worker.cancel()
+
+    def _start_worker(self, channel):
+        worker = asyncio.create_task(self._worker(channel))
+        worker.add_done_callback(lambda task: self._worker_done(channel, task))
+        self.workers[channel.id] = worker
+
+    def _worker_done(self, channel, task):
+        if task.cancelled(): # stopped by close()
+            return
+        self.logger.log(40, f"Dispatcher worker for channel {channel.id} stopped, restarting it. Error: {task.exception()!r}")
+        self._start_worker(channel)
+
+    def _done(self, count):
+        self.unfinished -= count
+        if self.unfinished <= 0:
+            self.unfinished = 0
+            self.all_done.set()
+
+    def _pack(self, pending): # takes the next message worth of embeds off the backlog
+        pack = []
+        chars = 0
+        while pending and len(pack) < self.max_embeds:
+            size = len(pending[0])
+            if pack and chars + size > self.max_chars:
+                break
+            pack.append(pending.popleft())
+            chars += size
+        return pack
+
+    def _digest(self, pending): # collapses the whole backlog into one embed per title
+        groups = defaultdict(list)
+        for embed in pending:
+            groups[embed.title].append(embed)
+        count = len(pending)
+        pending.clear()
+        digests = deque()
+        for title, embeds in groups.items():
+            lines = []
+            length = 0
+            for embed in embeds:
+                line = " |".join(part.strip() for part in (embed.description or "").split("\n"))
+                if length + len(line) + 1 > self.digest_chars:
+                    lines.append(f"...and {len(embeds) - len(lines)} more")
+                    break
+                lines.append(line)
+                length += len(line) + 1
+            digests.append(discord.Embed(title=f"{title} digest ({len(embeds)})", description="\n".join(lines), color=embeds[0].color))
+        self.digested += count
+        return digests, count
+
+    async def _wait_for_bucket(self, channel_id): # sleeps until the channel may send another message
+        sent_times = self.sent_times[channel_id]
+        while True:
+            now = time.monotonic()
+            while sent_times and now - sent_times[0] >= self.per:
+                sent_times.popleft()
+            if len(sent_times) < self.rate:
+                sent_times.append(now)
+                return
+            await asyncio.sleep(self.per - (now - sent_times[0]))
+
+    async def _worker(self, channel):
+        pending = self.pending[channel.id]
+        wakeup = self.wakeups[channel.id]
+        while True:
+            if not pending:
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+
+            if len(pending) < self.digest_threshold:
+                self.behind_since.pop(channel.id, None)
+            else:
+                self.behind_since.setdefault(channel.id, time.monotonic())
+
+            if channel.id in self.behind_since and time.monotonic() - self.behind_since[channel.id] >= self.digest_after:
+                del self.behind_since[channel.id]
+                digests, count = self._digest(pending)
+                self.logger.log(30, f"Channel {channel.id} has been {count} notifications behind for {self.digest_after}s, sending a digest.")
+                try:
+                    while digests:
+                        await self._send(channel, self._pack(digests))
+                finally: # taken off the backlog, join() must not wait for them again
+                    self._done(count)
+            else:
+                pack = self._pack(pending)
+                try:
+                    await self._send(channel, pack)
+                finally:
+                    self._done(len(pack))
+
+    async def _send(self, channel, pack):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_bucket(channel.id)
+            try:
+                await channel.send(embeds=pack)
+                self.messages += 1
+                self.embeds += len(pack)
+                return
+            except discord.HTTPException as e:
+                if e.status == 429 and attempt < self.max_retries: # discord.py gave up on the bucket, back off once more
+                    await asyncio.sleep(getattr(e, "retry_after", None) or self.per)
+                    continue
+                self.failed += len(pack)
+                self.logger.log(40, f"Failed to send {len(pack)} embeds to channel {channel.id}. Error: {e}")
+                return
+            except Exception as e:
+                self.failed += len(pack)
+                self.logger.log(40, f"Failed to send {len(pack)} embeds to channel {channel.id}. Error: {e}")
+                return
@@ -0,0 +1,111 @@
+import asyncio
+import io
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Rendering runs in worker processes so matplotlib, cartopy and the PNG encode never
+# block the bot's event loop. Every worker draws the coastline basemap once and reuses
+# it, a render only swaps the heatmap image on top of it and zooms to the box.
+
+_figure = None
+_axes = None
+
+def _init_worker():
+    global _figure, _axes
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import cartopy.crs as ccrs
+
+    _figure = Figure(figsize=(10, 10))
+    FigureCanvasAgg(_figure)
+    _axes = _figure.add_subplot(projection=ccrs.PlateCarree())
+    _axes.coastlines()
+    _axes.set_global()
+    _figure.canvas.draw() # loads and projects the coastlines once per worker
+
+def render_heatmap(x, y, counts, level, bbox): # runs in a worker, returns the PNG bytes
+    import cartopy.crs as ccrs
+    from scipy.ndimage import gaussian_filter
+    from shared import heatmapGrid
+
+    west, south, east, north = bbox
+    degrees = heatmapGrid.LEVEL_DEGREES[level]
+    bins = (max(round((east - west) / degrees), 1), max(round((north - south) / degrees), 1)) # one bin per cell of the level
+    longitudes, latitudes = heatmapGrid.cell_centers(x, y, level)
+    heatmap, xedges, yedges = np.histogram2d(
+        longitudes,
+        latitudes,
+        bins=bins,
+        range=[[west, east], [south, north]],
+        weights=counts,
+    )
+    heatmap = gaussian_filter(heatmap, sigma=1) # smoozes the colors
+
+    extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]]
+    _axes.set_extent(extent, crs=ccrs.PlateCarree())
+    image = _axes.imshow(heatmap.T, extent=extent, origin="lower", cmap="viridis", alpha=0.6)
+    try:
+        buf = io.BytesIO()
+        _figure.savefig(buf, format='png', bbox_inches='tight', pad_inches=0, dpi=150)
+        return buf.getvalue()
+    finally:
+        image.remove() # leaves the basemap as it was for the next render
+
+def _ready():
+    return True
+
+
+class HeatmapRenderer:
+    """
+    Renders heatmaps in a process pool and caches the PNGs.
+
+    Cache keys should include the data version so a new snapshot is never
+    served from an old render; entries also expire after ttl seconds and the
+    least recently used are evicted past max_entries. Concurrent requests for
+    the same key share one render.
+    """
+    def __init__(self, workers=1, ttl=900, max_entries=32):
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cache = OrderedDict() # key -> (expires, png)
+        self.inflight = {}
+
+    def warm(self): # starts the workers and draws their basemaps ahead of the first request
+        self.pool.submit(_ready)
+
+    def cached(self, key): # the cached PNG for key, or None
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return entry[1]
+
+    async def render(self, key, x, y, counts, level, bbox):
+        png = self.cached(key)
+        if png is not None:
+            return png
+        if key not in self.inflight:
+            loop = asyncio.get_running_loop()
+            self.inflight[key] = loop.run_in_executor(self.pool, render_heatmap, x, y, counts, level, bbox)
+        future = self.inflight[key]
+        try:
+            png = await asyncio.shield(future)
+        finally:
+            if future.done():
+                self.inflight.pop(key, None)
+
+        self.cache[key] = (time.monotonic() + self.ttl, png)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return png
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
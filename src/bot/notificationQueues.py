@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import deque
+
+
+class NotificationQueues:
+    """
+    One bounded queue per notification type behind a single get().
+
+    settings maps each type to {"priority", "weight", "max_depth"}. get() always
+    serves the highest priority (lowest number) type that has work; types that
+    share a priority are served weighted round robin, so a burst of one type
+    can only take its share of the turns. task_done() and join() work like
+    asyncio.Queue across all types.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.queues = {task_type: deque() for task_type in settings}
+        self.credits = {task_type: s["weight"] for task_type, s in settings.items()}
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.all_done = asyncio.Event()
+        self.all_done.set()
+        self.unfinished = 0
+
+        self.enqueued = dict.fromkeys(settings, 0)
+        self.dropped = dict.fromkeys(settings, 0)
+        self.served = dict.fromkeys(settings, 0)
+        self.total_wait = dict.fromkeys(settings, 0.0)
+        self.max_wait = dict.fromkeys(settings, 0.0)
+
+    def free(self, task_type): # remaining room in a type's queue
+        return self.settings[task_type]["max_depth"] - len(self.queues[task_type])
+
+    def put_nowait(self, task_type, data):
+        if self.free(task_type) <= 0:
+            self.dropped[task_type] += 1
+            raise asyncio.QueueFull
+        self.queues[task_type].append((time.monotonic(), data))
+        self.enqueued[task_type] += 1
+        self.unfinished += 1
+        self.all_done.clear()
+        self.not_empty.set()
+
+    async def put(self, task_type, data): # waits for room in the type's queue
+        while self.free(task_type) <= 0:
+            self.not_full.clear()
+            await self.not_full.wait()
+        self.put_nowait(task_type, data)
+
+    def drop(self, task_type): # counts an item rejected before it was queued, e.g. a disabled type
+        self.dropped[task_type] += 1
+
+    def _next_type(self):
+        ready = [task_type for task_type, queue in self.queues.items() if queue]
+        if not ready:
+            return None
+        top = min(self.settings[task_type]["priority"] for task_type in ready)
+        ready = [task_type for task_type in ready if self.settings[task_type]["priority"] == top]
+        if all(self.credits[task_type] <= 0 for task_type in ready): # every type used its turns, start a new round
+            for task_type in ready:
+                self.credits[task_type] = self.settings[task_type]["weight"]
+        task_type = max(ready, key=lambda t: self.credits[t])
+        self.credits[task_type] -= 1
+        return task_type
+
+    async def get(self): # returns (task_type, data) of the next item to handle
+        while True:
+            task_type = self._next_type()
+            if task_type:
+                break
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        enqueued_at, data = self.queues[task_type].popleft()
+        wait = time.monotonic() - enqueued_at
+        self.served[task_type] += 1
+        self.total_wait[task_type] += wait
+        self.max_wait[task_type] = max(self.max_wait[task_type], wait)
+        self.not_full.set()
+        return task_type, data
+
+    def task_done(self):
+        self.unfinished -= 1
+        if self.unfinished <= 0:
+            self.unfinished = 0
+            self.all_done.set()
+
+    async def join(self): # waits until every queued item was handled
+        await self.all_done.wait()
+
+    def stats(self): # per type depth, counters and queue wait, resetting the wait maximum
+        report = {}
+        for task_type in self.settings:
+            served = self.served[task_type]
+            report[task_type] = {
+                "depth": len(self.queues[task_type]),
+                "enqueued": self.enqueued[task_type],
+                "dropped": self.dropped[task_type],
+                "served": served,
+                "mean_wait_ms": round(self.total_wait[task_type] / served * 1000, 1) if served else 0,
+                "max_wait_ms": round(self.max_wait[task_type] * 1000, 1),
+            }
+            self.max_wait[task_type] = 0.0
+        return report
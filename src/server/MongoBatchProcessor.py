@@ -1,29 +1,217 @@
-from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, NetworkTimeout, ServerSelectionTimeoutError, AutoReconnect
+from bson import encode
+from bson.errors import InvalidDocument
+import os
 import time
+import random
+import pickle
+import struct
 import logging
 import sys
+import threading
+
+# errors worth retrying, anything else is a bad batch that would fail again
+TRANSIENT_ERRORS = (ConnectionFailure, NetworkTimeout, ServerSelectionTimeoutError, AutoReconnect)
+
+def op_size(op): # approximate BSON size of a write operation, its filter and document
+    try:
+        return len(encode({"q": getattr(op, "_filter", None), "u": getattr(op, "_doc", None)}))
+    except InvalidDocument:
+        return len(pickle.dumps(op, protocol=pickle.HIGHEST_PROTOCOL))
 
 class MongoBatchProcessor:
-    def __init__(self, collection, batch_size=50, interval=5):
+    """
+    Batches write operations for one collection and writes them on a background thread.
+
+    A batch is flushed when it reaches batch_size operations or max_batch_bytes,
+    when its oldest operation has waited interval seconds, or when flush_batch is
+    called. Failed writes are retried with exponential backoff; if Mongo stays
+    unreachable the batch is spilled to an append-only journal on disk and
+    replayed once writes succeed again. While anything is journaled, new
+    batches are appended behind it so operations reach Mongo in the order they
+    were added. Callers never block on the database.
+    """
+    def __init__(self, collection, batch_size=50, interval=5, max_batch_bytes=1_000_000, max_retries=4, retry_backoff=0.5, journal_dir="../../data/journal", replay_interval=30):
         self.logger = logging.getLogger("MongoBatchProcessor")
         self.logger.setLevel(logging.DEBUG)
-        self.logger.addHandler(logging.StreamHandler(sys.stdout))
+        if not self.logger.handlers:
+            self.logger.addHandler(logging.StreamHandler(sys.stdout))
 
         self.collection = collection
         self.batch_size = batch_size
         self.interval = interval
+        self.max_batch_bytes = max_batch_bytes
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.replay_interval = replay_interval
+
         self.batch = []
-        self.last_flush_time = time.time()
+        self.batch_bytes = 0
+        self.oldest = None # time the oldest pending operation was added
+        self.flush_requested = False
+        self.flush_generation = 0 # bumped by every flush_batch call
+        self.flushed_generation = 0 # last flush the background thread has finished
+        self.flushed_written = True # whether that flush reached Mongo
+        self.closed = False
+        self.condition = threading.Condition()
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, f"{collection.name}.journal")
+        self.replay_path = self.journal_path + ".replaying"
+        self.journal_pending = os.path.exists(self.journal_path) or os.path.exists(self.replay_path)
+        self.journal_drained = threading.Event() # set while nothing is left in the journal
+        if not self.journal_pending:
+            self.journal_drained.set()
+        self.last_replay_time = 0
+
+        self.thread = threading.Thread(target=self._run, name=f"MongoBatchProcessor-{collection.name}", daemon=True)
+        self.thread.start()
+
     def add_to_batch(self, update):
-        self.batch.append(update)
-        if len(self.batch) >= self.batch_size or time.time() - self.last_flush_time >= self.interval:
-            self.flush_batch()
-    def flush_batch(self):
-        if self.batch:
+        size = op_size(update)
+        with self.condition:
+            if not self.batch:
+                self.oldest = time.time()
+            self.batch.append(update)
+            self.batch_bytes += size
+            if len(self.batch) >= self.batch_size or self.batch_bytes >= self.max_batch_bytes:
+                self.condition.notify_all()
+
+    def flush_batch(self, wait=False, timeout=30): # asks the background thread to write the pending batch now
+        # with wait, blocks until it is done and returns whether it reached Mongo rather than the journal
+        with self.condition:
+            self.flush_requested = True
+            self.flush_generation += 1
+            generation = self.flush_generation
+            self.condition.notify_all()
+            if not wait:
+                return None
+            if not self.condition.wait_for(lambda: self.flushed_generation >= generation, timeout):
+                return False
+            return self.flushed_written
+
+    def wait_for_journal(self, timeout=None): # blocks until every journaled operation was written, False on timeout
+        return self.journal_drained.wait(timeout)
+
+    def close(self, timeout=30): # writes everything still pending and stops the background thread
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def _due(self):
+        if self.closed or self.flush_requested:
+            return True
+        if not self.batch:
+            return False
+        return len(self.batch) >= self.batch_size or self.batch_bytes >= self.max_batch_bytes or time.time() - self.oldest >= self.interval
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._due():
+                    timeout = self.interval if not self.batch else max(self.oldest + self.interval - time.time(), 0)
+                    if self.journal_pending:
+                        timeout = min(timeout, max(self.last_replay_time + self.replay_interval - time.time(), 0.1))
+                    if not self.condition.wait(timeout) and self.journal_pending:
+                        break # time to retry the journal
+                batch, self.batch = self.batch, []
+                self.batch_bytes = 0
+                self.flush_requested = False
+                generation = self.flush_generation
+                closed = self.closed
+
+            if self.journal_pending and (closed or time.time() - self.last_replay_time >= self.replay_interval):
+                self._replay_journal()
+            written = not self.journal_pending
+            if batch:
+                if self.journal_pending: # older operations are still journaled, this batch must not overtake them
+                    self._spill(batch)
+                else:
+                    written = self._write(batch)
+            with self.condition:
+                self.flushed_generation = generation
+                self.flushed_written = written
+                self.condition.notify_all()
+            if closed:
+                with self.condition:
+                    if not self.batch:
+                        return
+
+    def _write(self, batch, retries=None, spill=True): # writes a batch, spilling it to the journal if Mongo stays unreachable
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
             try:
-                self.collection.bulk_write(self.batch, ordered=False)
+                self.collection.bulk_write(batch, ordered=False)
+                return True
+            except BulkWriteError as e: # rejected operations, the rest of the batch was written
+                self.logger.log(40, f"{len(e.details.get('writeErrors', []))} writes rejected by {self.collection.name}: {e.details.get('writeErrors', [])[:1]}")
+                return True
+            except TRANSIENT_ERRORS as e:
+                self.logger.log(30, f"Error flushing batch to MongoDB (attempt {attempt + 1}/{retries + 1}): {e}")
+                if attempt < retries and not self.closed:
+                    time.sleep(self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
             except Exception as e:
-                self.logger.log(40, f"Error flushing batch to MongoDB: {e}")
-            finally:
-                self.batch = []
-                self.last_flush_time = time.time()
+                self.logger.log(40, f"Error flushing batch to MongoDB, dropping {len(batch)} operations: {e}")
+                return True
+        if spill:
+            self._spill(batch)
+        return False
+
+    def _spill(self, batch): # appends operations to the on-disk journal
+        with open(self.journal_path, "ab") as f:
+            for op in batch:
+                record = pickle.dumps(op, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(struct.pack(">I", len(record)))
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        if not self.journal_pending: # the next replay waits a full interval, Mongo just failed
+            self.last_replay_time = time.time()
+        self.journal_pending = True
+        self.journal_drained.clear()
+        self.logger.log(30, f"Spilled {len(batch)} operations for {self.collection.name} to {self.journal_path}")
+
+    def _read_journal(self, path):
+        ops = []
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                record = f.read(struct.unpack(">I", header)[0])
+                try:
+                    ops.append(pickle.loads(record))
+                except Exception: # torn write at the end of the journal
+                    break
+        return ops
+
+    def _rewrite_replay(self, ops): # atomically replaces the replay file with the operations still to write
+        tmp_path = self.replay_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for op in ops:
+                record = pickle.dumps(op, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(struct.pack(">I", len(record)))
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.replay_path)
+
+    def _replay_journal(self): # writes spilled operations back to Mongo, oldest first
+        self.last_replay_time = time.time()
+        while True:
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.journal_path):
+                    self.journal_pending = False
+                    self.journal_drained.set()
+                    return
+                os.replace(self.journal_path, self.replay_path)
+
+            ops = self._read_journal(self.replay_path)
+            self.logger.log(20, f"Replaying {len(ops)} journaled operations for {self.collection.name}")
+            for i in range(0, len(ops), self.batch_size):
+                if not self._write(ops[i:i + self.batch_size], retries=0, spill=False):
+                    # the unwritten operations stay in the replay file, ahead of anything journaled since
+                    self._rewrite_replay(ops[i:])
+                    return
+            os.remove(self.replay_path)
@@ -0,0 +1,47 @@
+from collections import Counter
+from pymongo import UpdateOne
+from shared.timeBuckets import RESOLUTIONS, bucket_start
+
+
+class AircraftRollups:
+    """
+    Per minute, hour and day counters of the aircraft types being flown.
+
+    Every tick adds the number of pilots flying each aircraft to the open
+    minute in memory. When the minute closes it is added with $inc to its
+    minute, hour and day bucket documents:
+
+        {resolution, bucket, samples, counts: {aircraft id: pilot ticks}}
+
+    counts / samples is the mean number of pilots flying an aircraft over the
+    bucket. Aircraft are keyed by id because names may contain dots.
+    """
+    def __init__(self, minute_retention_days=7):
+        self.minute_retention_days = minute_retention_days
+        self.minute = None
+        self.samples = 0
+        self.counts = Counter()
+
+    def create_indexes(self, collection):
+        collection.create_index([("resolution", 1), ("bucket", 1)], unique=True)
+        collection.create_index("bucket", expireAfterSeconds=self.minute_retention_days * 86400, partialFilterExpression={"resolution": "minute"}, name="minute_retention")
+
+    def observe(self, players, now): # adds a tick, returns the ops for the minute it closed, if any
+        minute = bucket_start(now, "minute")
+        ops = self.close() if self.minute is not None and minute != self.minute else []
+        self.minute = minute
+        self.samples += 1
+        self.counts.update(str(player.aircraft["id"]) for player in players)
+        return ops
+
+    def close(self): # ops adding the open minute to every resolution
+        if not self.samples:
+            return []
+        update = {"$inc": {"samples": self.samples, **{f"counts.{aircraft}": count for aircraft, count in self.counts.items()}}}
+        ops = [
+            UpdateOne({"resolution": resolution, "bucket": bucket_start(self.minute, resolution)}, update, upsert=True)
+            for resolution in RESOLUTIONS
+        ]
+        self.samples = 0
+        self.counts = Counter()
+        return ops
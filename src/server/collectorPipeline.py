@@ -0,0 +1,122 @@
+import asyncio
+import signal
+from scheduler import CadenceScheduler
+
+
+class CollectorPipeline:
+    """
+    Runs the collector as concurrent asyncio stages joined by bounded queues.
+
+        map poller  -> snapshots -> event detection  -\\
+        chat poller -> chat      -> chat store       --> batch processors -> persistence
+        config poller, heatmap snapshots
+
+    GeoFS is polled on the event loop through the shared aiohttp pool; blocking
+    work (Mongo calls, tick processing) runs in worker threads so a slow stage
+    never stalls the other polls. Map snapshots are
+    latest-wins: when detection falls behind the oldest snapshot is dropped.
+    Chat batches are never dropped; a full chat queue blocks the chat poller
+    instead.
+
+    Every polling stage runs on its own fixed-rate cadence, see scheduler.py.
+    """
+    def __init__(self, layer, config_cache, interval=1, snapshot_queue_size=2, chat_queue_size=30, report_interval=600):
+        self.layer = layer
+        self.config_cache = config_cache
+        self.interval = interval
+        self.snapshots = asyncio.Queue(maxsize=snapshot_queue_size)
+        self.chat = asyncio.Queue(maxsize=chat_queue_size)
+        self.dropped_snapshots = 0
+        self.failed_polls = 0
+
+        self.scheduler = CadenceScheduler()
+        self.config_cadence = self.scheduler.add("config", interval)
+        self.users_cadence = self.scheduler.add("users", interval)
+        self.chat_cadence = self.scheduler.add("chat", interval)
+        self.persist_cadence = self.scheduler.add("persistence", interval)
+        self.heatmap_cadence = self.scheduler.add("heatmap", 1800, start_delay=60) # first snapshot once users are loaded
+        self.report_cadence = self.scheduler.add("report", report_interval, start_delay=report_interval)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        tasks = [
+            asyncio.create_task(self.stage("config", self.poll_config)),
+            asyncio.create_task(self.stage("map", self.poll_map)),
+            asyncio.create_task(self.stage("chat", self.poll_chat)),
+            asyncio.create_task(self.stage("detection", self.detect_events)),
+            asyncio.create_task(self.stage("chat store", self.store_chat)),
+            asyncio.create_task(self.stage("persistence", self.persist)),
+            asyncio.create_task(self.stage("heatmap", self.snapshot_heatmap)),
+            asyncio.create_task(self.stage("report", self.report)),
+        ]
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, lambda: [task.cancel() for task in tasks])
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            self.layer.systemLogs.log(20, "Collector pipeline stopped.")
+        finally:
+            await self.layer.close_http()
+
+    async def stage(self, name, step): # runs a stage forever, logging errors instead of dying
+        while True:
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.layer.systemLogs.log(40, f"Error in {name} stage: {e}")
+                await asyncio.sleep(self.interval)
+
+    async def poll_config(self): # the cache calls back into the layer when the version moved
+        await self.config_cadence.wait()
+        if not self.config_cache.watching: # a change stream already keeps the cache fresh
+            await asyncio.to_thread(self.config_cache.refresh)
+
+    async def poll_map(self):
+        await self.users_cadence.wait()
+        if self.layer.config["storeUsers"]:
+            players = await self.layer.fetch_users()
+            if players is None: # a failed poll is not an empty server, the tick is skipped
+                self.failed_polls += 1
+                return
+            if self.snapshots.full(): # latest wins, detection only cares about the newest snapshot
+                self.snapshots.get_nowait()
+                self.dropped_snapshots += 1
+                self.layer.metricsLogs.log(30, f"Event detection is behind, dropped {self.dropped_snapshots} map snapshots so far.")
+            self.snapshots.put_nowait(players)
+
+    async def poll_chat(self):
+        await self.chat_cadence.wait()
+        if self.layer.config["saveChatMessages"]:
+            messages = await self.layer.fetch_chat_messages()
+            if messages:
+                await self.chat.put(messages)
+
+    async def detect_events(self):
+        players = await self.snapshots.get()
+        await asyncio.to_thread(self.layer.process_users, players)
+
+    async def store_chat(self):
+        messages = await self.chat.get()
+        await asyncio.to_thread(self.layer.store_chat_messages, messages)
+
+    async def persist(self):
+        await self.persist_cadence.wait()
+        await asyncio.to_thread(self.layer.flush_batches)
+
+    async def snapshot_heatmap(self):
+        await self.heatmap_cadence.wait()
+        if self.layer.config["accumulateHeatMap"]:
+            await asyncio.to_thread(self.layer.add_player_location_snapshot)
+
+    async def report(self): # logs tick jitter and overruns of every cadence, GeoFS request timings and the webhook telemetry
+        await self.report_cadence.wait()
+        for name, stats in self.scheduler.report().items():
+            if stats["ticks"]:
+                self.layer.metricsLogs.log(20, f"Cadence {name}: {stats['ticks']} ticks, {stats['overruns']} overruns, {stats['skipped']} skipped, jitter mean {stats['mean_jitter_ms']}ms max {stats['max_jitter_ms']}ms")
+        stats = self.layer.http_metrics.stats()
+        self.layer.metricsLogs.log(20, f"GeoFS HTTP: {stats['requests']} requests, {stats['reused']} reused, {stats['connections']} connections, {stats['stale']} stale, {stats['retries']} retries, {stats['gave_up']} gave up, {stats['short_circuited']} short circuited, {self.failed_polls} map ticks skipped, p50/p95 dns {stats['p50_dns_ms']}/{stats['p95_dns_ms']}ms connect {stats['p50_connect_ms']}/{stats['p95_connect_ms']}ms ttfb {stats['p50_ttfb_ms']}/{stats['p95_ttfb_ms']}ms")
+        for name, webhook in self.layer.webhooks.items():
+            stats = webhook.stats()
+            self.layer.metricsLogs.log(20, f"Webhook {name}: depth {stats['depth']}, {stats['sent']} sent, {stats['dropped']} dropped, {stats['failed']} failed, latency p50 {stats['p50_latency_ms']}ms p95 {stats['p95_latency_ms']}ms max {stats['max_latency_ms']}ms")
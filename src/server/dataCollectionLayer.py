@@ -1,22 +1,31 @@
 import time
-from pymongo import MongoClient, UpdateOne, InsertOne, DeleteOne
+from pymongo import MongoClient, InsertOne
+from pymongo.errors import OperationFailure
 import os
 import sys
 from dotenv import load_dotenv
 from urllib.parse import unquote
-from datetime import datetime, timedelta
-import numpy as np
+from datetime import datetime
 import requests
-import queue
-import threading
+import asyncio
 import logging
-import math
-import re
 import tracemalloc
 from MongoBatchProcessor import MongoBatchProcessor
+from userMaintenance import has_unique_account_index, remove_duplicate_users
+from presenceState import PresenceStateEngine
+from userWriteCoalescer import UserWriteCoalescer
+from forceFilters import ForceFilterMatcher
+from patrolSessionizer import PatrolSessionizer
+from webhookBatcher import WebhookBatcher
+from collectorPipeline import CollectorPipeline
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from shared import multiplayerAPI, mapAPI
+from shared import multiplayerAPI, mapAPI, http_client, async_http_client
+from shared.eventLog import EventLogWriter
+from shared.configCache import ConfigCache
+from shared import heatmapGrid
+from aircraftRollups import AircraftRollups
+from playerCountRollups import PlayerCountRollups
 
 tracemalloc.start()
 
@@ -36,70 +45,94 @@ class DataCollectionLayer():
         self.current_online_users = []
 
         # sets up APIs
-        self.multiplayer_api = multiplayerAPI.MultiplayerAPI(self.SESSION_ID, self.ACCOUNT_ID)
-        self.mapAPI = mapAPI.MapAPI()
+        self.multiplayer_api = multiplayerAPI.AsyncMultiplayerAPI(self.SESSION_ID, self.ACCOUNT_ID) # GeoFS is polled from the pipeline's event loop
+        self.mapAPI = mapAPI.AsyncMapAPI()
         self.mapAPI.disableResponseList()
+        self.http_metrics = http_client.metrics
 
         self.setup_batch_processors(db)
 
-        self.remove_duplicate_users(initial_cleanup=True)
-        db["users"].create_index("accountID", unique=True)
-
-        self.systemLogs.log(10, "Setting up queues and threads...")
-        self.setup_queues_and_threads()
-        self.last_aircraft_distribution_time = datetime.now()
+        # duplicates are cleaned up once, afterwards the unique index keeps them out
+        if not has_unique_account_index(db["users"]):
+            self.systemLogs.log(20, "Removing duplicate users before creating the unique accountID index...")
+            remove_duplicate_users(db["users"], log=lambda message: self.systemLogs.log(20, message))
+            try:
+                db["users"].create_index("accountID", unique=True)
+            except OperationFailure as e:
+                self.systemLogs.log(40, f"Could not create the unique accountID index, duplicates with events remain. Run tools/migrate_user_events.py and server/userMaintenance.py. Error: {e}")
+        db["user_events"].create_index([("accountID", 1), ("timestamp", 1)])
+        heatmapGrid.create_indexes(db["heatmap_cells"])
+        self.aircraft_rollups = AircraftRollups()
+        self.aircraft_rollups.create_indexes(db["aircraft_rollups"])
+        self.player_counts = PlayerCountRollups()
+        self.player_counts.create_indexes(db["player_counts"])
+
+        self.systemLogs.log(10, "Warming presence state...")
+        self.presence = PresenceStateEngine()
+        self.force_filters = ForceFilterMatcher()
+        self.patrols = PatrolSessionizer(logger=self.offlineOnlineLogs)
+        PatrolSessionizer.create_indexes(db["patrol_sessions"])
+        # journaled session writes from the previous run must land first, or they would reopen what is closed here
+        if self.batch_processors["patrol_sessions"].wait_for_journal(timeout=60):
+            closed = PatrolSessionizer.close_stale(db["patrol_sessions"])
+            self.systemLogs.log(10, f"Closed {closed} patrol sessions left open by the previous run.")
+        else:
+            self.systemLogs.log(40, "Patrol session journal not replayed within 60s, sessions left open by the previous run stay open.")
+        self.user_writes = UserWriteCoalescer(refresh_interval=self.USER_REFRESH_INTERVAL)
+        warmed = self.presence.warm(db["users"])
+        self.systemLogs.log(10, f"Loaded presence state for {warmed} accounts.")
+
+        self.systemLogs.log(10, f"Setting up {self.NOTIFICATION_TRANSPORT} notifications...")
+        self.setup_notifications()
 
         self.systemLogs.log(10, "Getting configuration settings...")
-        self.config = self.getConfigurationSettings()
-        
-        self.MAX_REQUESTS = 10
-
-    def setup_queues_and_threads(self):
-        self.queues = {
-            "callsign_change": queue.Queue(),
-            "new_account": queue.Queue(),
-            "aircraft_change": queue.Queue()
-        }
-        self.sessions = {
-            "callsign_change": requests.Session(),
-            "new_account": requests.Session(),
-            "aircraft_change": requests.Session()
-        }
-        self.start_webhook_threads()
+        self.config_cache = ConfigCache(db["configurations"])
+        self.config_cache.add_listener(self.on_config_change)
+        self.config = self.config_cache.ensure_defaults(log=lambda message: self.systemLogs.log(20, message))
+        self.config_cache.refresh()
+        if self.config_cache.watching:
+            self.systemLogs.log(10, "Following configuration changes on a change stream.")
+
+    def setup_notifications(self):
+        # the event log is durable and read by the bot at its own pace, webhooks are kept for bots on another host
+        if self.NOTIFICATION_TRANSPORT not in ("eventlog", "webhook"): # notify would fail every tick and lose its writes
+            self.systemLogs.log(50, f"Unknown NOTIFICATION_TRANSPORT {self.NOTIFICATION_TRANSPORT!r}, expected 'eventlog' or 'webhook'.")
+            raise ValueError(f"Unknown NOTIFICATION_TRANSPORT {self.NOTIFICATION_TRANSPORT!r}")
+        self.event_log = EventLogWriter() if self.NOTIFICATION_TRANSPORT == "eventlog" else None
+        self.webhooks = {}
+        if self.NOTIFICATION_TRANSPORT == "webhook":
+            self.webhooks = {
+                name: WebhookBatcher(name, requests.Session(), self.systemLogs)
+                for name in ("callsign-change", "new-account", "aircraft-change", "bot-mention")
+            }
+
+    def notify(self, events): # hands a list of {'type', 'data'} events to the bot in one batch
+        if not events:
+            return
+        if self.event_log:
+            try:
+                self.event_log.append(events)
+            except OSError as e:
+                self.systemLogs.log(40, f"Failed to append {len(events)} events to the event log. Error: {e}")
+            return
+        for event in events:
+            self.webhooks[event['type']].submit(f"{self.BOT_URL}/{event['type']}", event['data'])
 
     def setup_batch_processors(self, db):
         self.batch_processors = {
-            "forces": MongoBatchProcessor(db["forces"]),
-            "player_locations": MongoBatchProcessor(db["player_locations"]),
+            "patrol_sessions": MongoBatchProcessor(db["patrol_sessions"]),
+            "heatmap_cells": MongoBatchProcessor(db["heatmap_cells"]),
+            "aircraft_rollups": MongoBatchProcessor(db["aircraft_rollups"]),
+            "player_counts": MongoBatchProcessor(db["player_counts"]),
             "chat_messages": MongoBatchProcessor(db["chat_messages"]),
-            "users": MongoBatchProcessor(db["users"])
+            "users": MongoBatchProcessor(db["users"]),
+            "user_events": MongoBatchProcessor(db["user_events"])
         }
 
-    def getConfigurationSettings(self):
-        db = self.mongo_db_client[self.DATABASE_NAME]
-        collection = db["configurations"]
-        config = collection.find_one()
-        if config == None:
-            config = self.initialize_default_config(collection)
-        return config
-    
-    def initialize_default_config(self, collection):
-        DEFAULT_CONFIG = {
-            "saveChatMessages": True,
-            "accumulateHeatMap": True,
-            "storeUsers": True,
-            "callsignChangeLogChannel": None,
-            "newAccountLogChannel": None,
-            "aircraftChangeLogChannel": None,
-            "displayCallsignChanges": True,
-            "displayNewAccounts": True,
-            "countUsers": True,
-            "logAircraftDistributions": True,
-            "logAircraftChanges": True,
-            "logMRPActivity": True,
-        }
-        collection.insert_one(DEFAULT_CONFIG)
-        return DEFAULT_CONFIG
+    def on_config_change(self, config, changed): # called by the config cache with every new version
+        for key, value in changed.items():
+            self.systemLogs.log(20, f"Configuration setting {key} changed to {value}")
+        self.config = config
 
     def setup_logger(self):
         if not os.path.exists("../../logs"):
@@ -152,6 +185,14 @@ class DataCollectionLayer():
         systemFormatter = logging.Formatter("%(asctime)s - %(message)s")
         systemHandler.setFormatter(systemFormatter)
         self.systemLogs.addHandler(systemHandler)
+
+        # collector telemetry, kept apart from server-events which only records errors
+        self.metricsLogs = logging.getLogger("collector-metrics")
+        self.metricsLogs.setLevel(logging.INFO)
+        metricsHandler = logging.FileHandler("../../logs/collector-metrics.log")
+        metricsFormatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        metricsHandler.setFormatter(metricsFormatter)
+        self.metricsLogs.addHandler(metricsHandler)
     
     def load_environment_variables(self):
         self.SESSION_ID = os.getenv('GEOFS_SESSION_ID')
@@ -159,6 +200,9 @@ class DataCollectionLayer():
         self.DATABASE_NAME = os.getenv('DATABASE_NAME')
         self.DATABASE_IP = os.getenv('DATABASE_IP')
         self.DATABASE_USER = os.getenv('DATABASE_USER')
+        self.USER_REFRESH_INTERVAL = int(os.getenv('USER_REFRESH_INTERVAL', 60)) # seconds between lastOnline/lastPosition writes
+        self.NOTIFICATION_TRANSPORT = os.getenv('NOTIFICATION_TRANSPORT', 'eventlog') # 'eventlog' or 'webhook'
+        self.BOT_URL = os.getenv('BOT_URL', 'http://localhost:5001')
 
     def get_mongo_uri(self):
         DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
@@ -166,323 +210,185 @@ class DataCollectionLayer():
         print(connection_string)
         return connection_string
         
-    def start_webhook_threads(self):
-        for key in self.queues:
-            thread = threading.Thread(target=self.webhook_processor, args=(key,))
-            thread.daemon = True
-            thread.start()
-
-    def webhook_processor(self, queue_name, batch_size=50, batch_interval=0.02, timeout=5):
-        batch = []
-        last_send_time = time.time()
-        while True:
-            try:
-                if not self.queues[queue_name].empty():
-                    batch.append(self.queues[queue_name].get())
-                if len(batch) >= batch_size or (time.time() - last_send_time) >= timeout:
-                    if batch:
-                        self.send_batch(batch, self.sessions[queue_name])
-                        last_send_time = time.time()
-                        batch.clear()
-                time.sleep(batch_interval)
-            except Exception as e:
-                self.systemLogs.log(40, f"Error processing {queue_name} queue: {e}")
-                time.sleep(30 / self.MAX_REQUESTS)
-
-    def send_batch(self, batch, session):
-        try:
-            response = session.post(
-                batch[0]["url"],
-                json=[req["data"] for req in batch]
-            )
-            if response.status_code != 204:
-                self.systemLogs.log(30, f"Batch send failed. Status code: {response.status_code}")
-        except Exception as e:
-            self.systemLogs.log(40, f"Batch send failed. Error: {e}")
-
     def check_chat_messages_for_mention(self):
+        mentions = []
         for message in self.current_chat_messages:
             for item in ["mindseye", "minds eye", "minds-eye"]:
                 if  item in message["msg"].lower():
-                    url = f"http://localhost:5001/bot-mention"
-                    data = {"message": True}
                     self.systemLogs.log(20, "Detected pilot mentioned bot.")
-                    try:
-                        response = requests.post(url, json=data)
-                    except Exception as e:
-                        self.systemLogs.log(40, f"Failed to trigger event. Error: {e}")
-
-    def fetch_chat_messages(self): # fetches chat messages from the multiplayer API
-        self.current_chat_messages = [
+                    mentions.append({'type':'bot-mention', 'data':{'message': True}})
+        self.notify(mentions)
+
+    async def fetch_chat_messages(self): # fetches chat messages from the multiplayer API, None when the request failed
+        messages = await self.multiplayer_api.getMessages()
+        if messages is None:
+            return None
+        return [
             {**message, "msg": unquote(message["msg"]), "datetime": datetime.now()}
-            for message in self.multiplayer_api.getMessages()
-        ]
-        self.check_chat_messages_for_mention()
-        if self.current_chat_messages:
-            for msg in self.current_chat_messages:
-                self.batch_processors["chat_messages"].add_to_batch(InsertOne(msg))
-        self.batch_processors["chat_messages"].flush_batch()
-
-    def add_player_location_snapshot(self): # adds a snapshot of player locations to the database
-        docs = [
-            {
-                "latitude": user.coordinates[0],
-                "longitude": user.coordinates[1]
-            } for user in self.current_online_users
+            for message in messages
         ]
-        if docs:
-            for doc in docs:
-                self.batch_processors["player_locations"].add_to_batch(InsertOne(doc))
-        self.batch_processors["player_locations"].flush_batch()
 
-    def add_online_player_count(self): # adds the number of online players to the database
+    def store_chat_messages(self, messages): # queues chat messages for the database
+        self.current_chat_messages = messages
+        self.check_chat_messages_for_mention()
+        for msg in messages:
+            self.batch_processors["chat_messages"].add_to_batch(InsertOne(msg))
+
+    def add_player_location_snapshot(self): # adds the current player locations to the daily heatmap cell counters
+        users = self.current_online_users
+        latitudes = [user.coordinates[0] for user in users]
+        longitudes = [user.coordinates[1] for user in users]
+        now = datetime.now()
+        for op in heatmapGrid.cell_updates(latitudes, longitudes, now):
+            self.batch_processors["heatmap_cells"].add_to_batch(op)
+        # the bot caches rendered heatmaps per version, so the version only moves once the cells are in Mongo
+        if not self.batch_processors["heatmap_cells"].flush_batch(wait=True):
+            self.metricsLogs.log(30, "Heatmap cells were journaled instead of written, the heatmap version is left as it is.")
+            return
         db = self.mongo_db_client[self.DATABASE_NAME]
-        collection = db["online_player_count"]
-        collection.insert_one({"count": len(self.current_online_users), "datetime": datetime.now()})
+        db["heatmap_meta"].update_one({"_id": "cells"}, {"$inc": {"version": 1}, "$set": {"updated": now}}, upsert=True)
+
+    def update_aircraft_rollups(self, players, now): # counts the aircraft flown this tick into the minute, hour and day rollups
+        if self.config.get('logAircraftDistributions', True):
+            ops = self.aircraft_rollups.observe(players, now)
+        else:
+            ops = self.aircraft_rollups.close()
+        for op in ops:
+            self.batch_processors['aircraft_rollups'].add_to_batch(op)
+
+    def close_aircraft_rollups(self): # writes the open minute, called on shutdown
+        for op in self.aircraft_rollups.close():
+            self.batch_processors['aircraft_rollups'].add_to_batch(op)
+
+    def update_player_counts(self, players, now): # samples the number of online players into the minute, hour and day series
+        if self.config.get('countUsers', True):
+            ops = self.player_counts.observe(len(players), now)
+        else:
+            ops = self.player_counts.close()
+        for op in ops:
+            self.batch_processors['player_counts'].add_to_batch(op)
+
+    def close_player_counts(self): # writes the open minute, called on shutdown
+        for op in self.player_counts.close():
+            self.batch_processors['player_counts'].add_to_batch(op)
     
-    def calculate_aircraft_change(self, old_lat, old_lon, new_lat, new_lon): # calculates the distance between the old and new pilot position
-        if None in (old_lat, old_lon, new_lat, new_lon):
-            return 0
-        # convert points to radians
-        lon1, lat1, lon2, lat2 = map(math.radians, [old_lon, old_lat, new_lon, new_lat])
-
-        # harversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-
-        # radius of earth
-        R = 6371
-        return c * R
-    
-    def get_force_callsign_filters(self): # gets the force callsign_filters from the database
-        db = self.mongo_db_client[self.DATABASE_NAME]
-        collection = db["forces"]
-        forces = collection.find()
-        return [force["callsign_filter"] for force in forces]
-
-    def update_airforce_patrol_logs(self, going_online, user, force_callsign_filters):
-
-        for force in force_callsign_filters:
-            regex_pattern = force.replace('[', r'\[').replace(']', r'\]').replace('X', '.')
-
-            regex = re.compile(r".*" + regex_pattern + r".*", re.IGNORECASE)
-            if regex.search(user["currentCallsign"]):
-                if going_online:
-                    self.offlineOnlineLogs.log(20, f"Account ID: {user['accountID']} is patrolling for force {force}.")
-                    force_event = {
-                        "accountID": user["accountID"],
-                        "callsign": user["currentCallsign"],
-                        "start_time": datetime.now(),
-                        "end_time": None
-                    }
-                    self.batch_processors["forces"].add_to_batch(
-                        UpdateOne(
-                            {"callsign_filter": force},
-                            {"$push": {"patrols": force_event}}
-                        )
-                    )
-                else:
-                    self.offlineOnlineLogs.log(20, f"Account ID: {user['accountID']} is no longer patrolling for force {force}.")
-                    self.batch_processors["forces"].add_to_batch(
-                        UpdateOne(
-                            {"callsign_filter": force, "patrols.accountID": user["accountID"], "patrols.end_time": None},
-                            {"$set": {"patrols.$.end_time": datetime.now()}}
-                        )
-                    )
-        self.batch_processors["forces"].flush_batch()
-
-    def process_users(self):
-        self.remove_duplicate_users()
-        raw = self.mapAPI.getUsers(False) or []
+    def update_patrol_sessions(self, players, now): # feeds the patrol sessionizer with the current tick
+        if self.config.get('logMRPActivity', True):
+            ops = self.patrols.observe(players, self.force_filters, now)
+        else:
+            ops = self.patrols.close_all()
+        for op in ops:
+            self.batch_processors['patrol_sessions'].add_to_batch(op)
+
+    def close_patrol_sessions(self): # closes every open patrol, called on shutdown
+        for op in self.patrols.close_all():
+            self.batch_processors['patrol_sessions'].add_to_batch(op)
+        self.batch_processors['patrol_sessions'].flush_batch()
+
+    async def fetch_users(self): # fetches the online users from the map API without duplicates, None when the request failed
+        raw = await self.mapAPI.getUsers(False)
+        if raw is None:
+            return None
         seen = set(); unique = []
         for u in raw:
             uid = u.userInfo['id']
             if uid and uid not in seen:
                 seen.add(uid); unique.append(u)
+        return unique
+
+    async def close_http(self): # closes the pooled GeoFS connections, called when the pipeline stops
+        await async_http_client.close_session()
+
+    def process_users(self, unique):
         self.current_online_users = unique
 
-        db = self.mongo_db_client[self.DATABASE_NAME]
-        user_coll = db['users']
         configs = self.config
-
-        # prepare existing map
-        cur_ids = [u.userInfo['id'] for u in unique]
-        exist_map = {d['accountID']: d for d in user_coll.find({'accountID':{'$in':cur_ids}})}
+        now = datetime.now()
+        transitions = self.presence.update(unique, now)
+        notifications = []
+        db = self.mongo_db_client[self.DATABASE_NAME]
+        self.force_filters.refresh(db['forces'], configs.get('forcesVersion', 0))
 
         # Handle users going offline
-        going_offline = list(user_coll.find({
-            'Online': True,
-            'accountID': {'$nin': cur_ids}
-        }))
-        for doc in going_offline:
-            if datetime.now() - doc['lastOnline'] > timedelta(minutes=1):
-                self.offlineOnlineLogs.info(f"Account ID: {doc['accountID']} is offline.")
-                evt = {'eventType':'offline', 'timestamp':doc['lastOnline']}
-                self.batch_processors['users'].add_to_batch(
-                    UpdateOne(
-                        {'accountID':doc['accountID']},
-                        {'$set':{'Online':False, 'lastOnline':datetime.now()}, '$push':{'events':evt}}
-                    )
-                )
-                self.update_airforce_patrol_logs(False, doc, self.get_force_callsign_filters())
+        for pilot in transitions.offline:
+            self.offlineOnlineLogs.info(f"Account ID: {pilot['accountID']} is offline.")
+            self.add_user_event(pilot['accountID'], {'eventType':'offline', 'timestamp':pilot['lastOnline']})
+            self.user_writes.stage(pilot['accountID'], now, Online=False)
         # handle users going online
-        going_online = list(user_coll.find({
-            'Online': False,
-            'accountID': {'$in': cur_ids}
-        }))
-        for doc in going_online:
-            self.offlineOnlineLogs.info(f"Account ID: {doc['accountID']} is online.")
-            evt = {'eventType':'online', 'timestamp':datetime.now()}
-            self.batch_processors['users'].add_to_batch(
-                UpdateOne(
-                    {'accountID':doc['accountID']},
-                    {'$set':{'Online':True}, '$push':{'events':evt}}
-                )
-            )
-            self.update_airforce_patrol_logs(True, doc, self.get_force_callsign_filters())
+        for pilot in transitions.online:
+            self.offlineOnlineLogs.info(f"Account ID: {pilot['accountID']} is online.")
+            self.add_user_event(pilot['accountID'], {'eventType':'online', 'timestamp':now})
+        # new-account hook
+        if configs['displayNewAccounts']:
+            for pilot in transitions.new_accounts:
+                notifications.append({'type':'new-account', 'data':{'acid':pilot['accountID'],'callsign':pilot['callsign']}})
+
+        # event detection
+        for jump in transitions.teleports:
+            uid = jump['accountID']; old = jump['oldPosition']; pos = jump['newPosition']
+            speed = f" at {round(jump['speed'])} km/h" if jump['speed'] is not None else ""
+            self.teleportationLogs.info(f"Account ID: {uid} teleported {round(jump['distance'])} km{speed}.")
+            self.add_user_event(uid, {'eventType':'teleportation','oldLatitude':old[0],'oldLongitude':old[1],'newLatitude':pos[0],'newLongitude':pos[1],'timestamp':now,'distance':jump['distance'],'speed':jump['speed']})
+        if configs['logAircraftChanges']:
+            for change in transitions.aircraft_changes:
+                uid = change['accountID']; old_ac = change['oldAircraft']; ac = change['newAircraft']
+                self.aircraftChangeLogs.info(f"Aircraft change: {uid} from {old_ac} to {ac}")
+                self.add_user_event(uid, {'eventType':'aircraftChange','oldAircraft':old_ac,'newAircraft':ac,'timestamp':now})
+                notifications.append({'type':'aircraft-change', 'data':{'callsign':change['callsign'],'oldAircraft':old_ac,'newAircraft':ac}})
+        for change in transitions.callsign_changes:
+            uid = change['accountID']; old_cs = change['oldCallsign']; cs = change['newCallsign']
+            self.callsignChangeLogs.info(f"Callsign change: {uid} from {old_cs} to {cs}")
+            self.add_user_event(uid, {'eventType':'callsignChange','oldCallsign':old_cs,'newCallsign':cs,'timestamp':now})
+            if configs['displayCallsignChanges']:
+                notifications.append({'type':'callsign-change', 'data':{'acid':uid,'oldCallsign':old_cs,'newCallsign':cs}})
+        self.notify(notifications) # one append per tick
 
         # Process current online users
-        filters = self.get_force_callsign_filters()
         for u in unique:
-            uid = u.userInfo['id']; cs = u.userInfo['callsign']; ac = u.aircraft['type']; pos = u.coordinates
-            # new-account hook
-            if uid not in exist_map and configs['displayNewAccounts']:
-                self.queues['new_account'].put({'url':'http://localhost:5001/new-account','data':{'acid':uid,'callsign':cs}})
-                self.update_airforce_patrol_logs(True, {'accountID':uid,'currentCallsign':cs}, filters)
-            # event detection
-            evts = []
-            # teleport
-            old = exist_map.get(uid, {}).get('lastPosition')
-            if old:
-                dist = self.calculate_aircraft_change(old[0], old[1], pos[0], pos[1])
-                if dist >= 50:
-                    self.teleportationLogs.info(f"Account ID: {uid} teleported {round(dist)} km.")
-                    evts.append({'eventType':'teleportation','oldLatitude':old[0],'oldLongitude':old[1],'newLatitude':pos[0],'newLongitude':pos[1],'timestamp':datetime.now(),'distance':dist})
-            # aircraft change
-            old_ac = exist_map.get(uid, {}).get('currentAircraft')
-            if configs['logAircraftChanges'] and old_ac and ac != old_ac:
-                self.aircraftChangeLogs.info(f"Aircraft change: {uid} from {old_ac} to {ac}")
-                evts.append({'eventType':'aircraftChange','oldAircraft':old_ac,'newAircraft':ac,'timestamp':datetime.now()})
-                self.queues['aircraft_change'].put({'url':'http://localhost:5001/aircraft-change','data':{'callsign':cs,'oldAircraft':old_ac,'newAircraft':ac}})
-            # callsign change
-            old_cs = exist_map.get(uid, {}).get('currentCallsign')
-            if old_cs and old_cs != cs:
-                self.callsignChangeLogs.info(f"Callsign change: {uid} from {old_cs} to {cs}")
-                evts.append({'eventType':'callsignChange','oldCallsign':old_cs,'newCallsign':cs,'timestamp':datetime.now()})
-                if configs['displayCallsignChanges']:
-                    self.queues['callsign_change'].put({'url':'http://localhost:5001/callsign-change','data':{'acid':uid,'oldCallsign':old_cs,'newCallsign':cs}})
-
-            # upsert user doc
-            upsert = UpdateOne(
-                {'accountID':uid},
-                {
-                    '$setOnInsert':{'accountID':uid},
-                    '$set':{'currentCallsign':cs,'currentAircraft':ac,'Online':True,'lastOnline':datetime.now(),'lastPosition':pos},
-                    '$addToSet':{'pastCallsigns':cs},
-                    **({'$push':{'events':{'$each':evts}}} if evts else {})
-                },
-                upsert=True
+            uid = u.userInfo['id']
+            self.user_writes.stage(
+                uid, now,
+                position=u.coordinates,
+                currentCallsign=u.userInfo['callsign'],
+                currentAircraft=u.aircraft['type'],
+                Online=True
             )
-            self.batch_processors['users'].add_to_batch(upsert)
-
-        self.batch_processors['users'].flush_batch()
-
-    def remove_duplicate_users(self, initial_cleanup=False):
-        db = self.mongo_db_client[self.DATABASE_NAME]
-        user_collection = db["users"]
 
-        with open("removed_users.txt", "a") as f:
-            pipeline = [
-                {"$group": {"_id": "$accountID", "count": {"$sum": 1}, "ids": {"$push": "$_id"}}},
-                {"$match": {"count": {"$gt": 1}}}
-            ]
-            duplicates = list(user_collection.aggregate(pipeline))
+        # only the fields that changed since the last write are sent
+        for op in self.user_writes.drain():
+            self.batch_processors['users'].add_to_batch(op)
 
-            for duplicate in duplicates:
-                ids_to_check = sorted(duplicate["ids"])
+        self.update_patrol_sessions(unique, now)
+        self.update_aircraft_rollups(unique, now)
+        self.update_player_counts(unique, now)
 
-                for _id in ids_to_check[1:]:
-                    user = user_collection.find_one({"_id": _id})
-                    if not user.get("events"):
-                        f.write(f"Removed duplicate user with accountID {duplicate['_id']} and _id {_id}\n")
+    def flush_batches(self): # writes every pending batch to the database
+        for processor in self.batch_processors.values():
+            processor.flush_batch()
 
-                        if initial_cleanup:
-                            user_collection.delete_one({"_id": _id})
-                        else:
-                            self.batch_processors["users"].add_to_batch(DeleteOne({"_id": _id}))
-                            self.systemLogs.log(20, f"Removed duplicate user with accountID {duplicate['_id']} and _id {_id}")
+    def close_batches(self): # drains every batch processor, called on shutdown
+        for processor in self.batch_processors.values():
+            processor.close()
 
-        if not initial_cleanup:
-            self.batch_processors["users"].flush_batch()
+    def add_user_event(self, accountID, event): # appends an event to the user_events collection
+        self.batch_processors['user_events'].add_to_batch(InsertOne({'accountID':accountID, **event}))
 
 def main():
     data_collection_layer = DataCollectionLayer()
     data_collection_layer.systemLogs.log(20, "Starting data collection layer...")
-    last_snapshot_time = 1800
-    last_user_count_time = time.time()
-
-    db = data_collection_layer.mongo_db_client[data_collection_layer.DATABASE_NAME]
-    collection = db["configurations"]
-    configuration = collection.find_one()
-    DEFAULT_CONFIG = {
-        "saveChatMessages": True,
-        "accumulateHeatMap": True,
-        "storeUsers": True,
-        "callsignChangeLogChannel": None,
-        "newAccountLogChannel": None,
-        "aircraftChangeLogChannel": None,
-        "displayCallsignChanges": True,
-        "displayNewAccounts": True,
-        "displayAircraftChanges": True,
-        "countUsers": True,
-        "logAircraftDistributions": True,
-        "logAircraftChanges": True,
-        "logMRPActivity": True,
-    }
-
-    if configuration is None:
-        collection.insert_one(DEFAULT_CONFIG)
-    else: # checks if the configuration settings exist
-        for key, value in DEFAULT_CONFIG.items(): # checks if the configuration settings are missing
-            if key not in configuration:
-                data_collection_layer.systemLogs.log(20, "Found a new configuration setting. Adding it to the database.")
-                collection.update_one(
-                    {"_id": configuration["_id"]},
-                    {"$set": {key: value}}
-                )
-                configuration[key] = value
-        keys_to_remove = [key for key in configuration if key not in DEFAULT_CONFIG and key != "_id"]
-        if keys_to_remove:
-            data_collection_layer.systemLogs.log(20, "Found old configuration settings. Removing them from the database.")
-            collection.update_one(
-                {"_id": configuration["_id"]},
-                {"$unset": {key: "" for key in keys_to_remove}}
-            )
-            for key in keys_to_remove:
-                del configuration[key]
-    previous_configuration = configuration
 
     data_collection_layer.systemLogs.log(20, "Data collection layer started.")
-    while True: # loops every second for api calls
-        configuration = collection.find_one()
-
-        for key in previous_configuration: # checks if the configuration settings have changed
-            if previous_configuration[key] != configuration[key]:
-                data_collection_layer.systemLogs.log(20, f"Configuration setting {key} changed to {configuration[key]}")
-                previous_configuration[key] = configuration[key]
-        
-        if configuration["storeUsers"]:
-            data_collection_layer.process_users()
-        if configuration["saveChatMessages"]:
-            data_collection_layer.fetch_chat_messages()
-        if configuration["accumulateHeatMap"] and (time.time() - last_snapshot_time >= 1800):
-            last_snapshot_time = time.time()
-            data_collection_layer.add_player_location_snapshot()
-        if configuration["countUsers"] and (time.time() - last_user_count_time >= 3600):
-            data_collection_layer.add_online_player_count()
-        time.sleep(1)
+    pipeline = CollectorPipeline(data_collection_layer, data_collection_layer.config_cache)
+    try:
+        asyncio.run(pipeline.run())
+    finally:
+        data_collection_layer.systemLogs.log(20, "Closing open patrol sessions...")
+        data_collection_layer.close_patrol_sessions()
+        data_collection_layer.close_aircraft_rollups()
+        data_collection_layer.close_player_counts()
+        data_collection_layer.close_batches()
+        if data_collection_layer.event_log:
+            data_collection_layer.event_log.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
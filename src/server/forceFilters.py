@@ -0,0 +1,50 @@
+import re
+
+
+def filter_to_pattern(callsign_filter): # converts a force callsign_filter into a regex, X is a wildcard
+    return callsign_filter.replace('[', r'\[').replace(']', r'\]').replace('X', '.')
+
+
+class ForceFilterMatcher:
+    """
+    Compiled matcher for every force callsign_filter.
+
+    All filters are folded into a single alternation so a callsign that belongs
+    to no force is rejected with one regex search. Only callsigns that hit the
+    combined pattern are checked against the individual filters. The matcher is
+    rebuilt when the forcesVersion stamp in the configuration changes.
+    """
+    def __init__(self):
+        self.version = None
+        self.forces = []    # [{'name', 'callsign_filter'}]
+        self._patterns = [] # [(compiled regex, force)]
+        self._combined = None
+
+    def refresh(self, forces_collection, version): # reloads the filters if the forces set changed
+        if version == self.version and self._combined is not None:
+            return False
+        self.load(forces_collection.find({}, {"_id": 0, "name": 1, "callsign_filter": 1}))
+        self.version = version
+        return True
+
+    def load(self, forces): # compiles the filters of the given forces
+        self.forces = []
+        self._patterns = []
+        for force in forces:
+            pattern = filter_to_pattern(force["callsign_filter"])
+            try:
+                regex = re.compile(pattern, re.IGNORECASE)
+            except re.error:
+                continue
+            self.forces.append(force)
+            self._patterns.append((regex, force))
+
+        if self._patterns:
+            self._combined = re.compile("|".join(f"(?:{regex.pattern})" for regex, _ in self._patterns), re.IGNORECASE)
+        else:
+            self._combined = re.compile(r"(?!)") # matches nothing
+
+    def match(self, callsign): # returns every force whose filter matches the callsign
+        if not callsign or not self._combined.search(callsign):
+            return []
+        return [force for regex, force in self._patterns if regex.search(callsign)]
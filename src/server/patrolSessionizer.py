@@ -0,0 +1,140 @@
+from bson import ObjectId
+from pymongo import UpdateOne
+from datetime import datetime
+
+
+class PatrolSession:
+    """An open patrol of one account for one force."""
+    __slots__ = ("_id", "force", "callsign_filter", "accountID", "callsign", "start_time", "last_seen", "airborne_seconds", "last_checkpoint")
+
+    def __init__(self, force, accountID, callsign, now):
+        self._id = ObjectId()
+        self.force = force["name"]
+        self.callsign_filter = force["callsign_filter"]
+        self.accountID = accountID
+        self.callsign = callsign
+        self.start_time = now
+        self.last_seen = now
+        self.airborne_seconds = 0
+        self.last_checkpoint = now
+
+
+class PatrolSessionizer:
+    """
+    Turns the per-tick stream of online pilots into patrol sessions.
+
+    A session opens when a pilot's callsign matches a force filter and closes
+    when the callsign stops matching or the pilot has not been seen for
+    idle_timeout seconds. Only time spent at or above airborne_airspeed is
+    counted towards airborne_seconds, so time landed is excluded.
+
+    Every method returns the write operations for the patrol_sessions
+    collection; the caller is responsible for batching them.
+    """
+    def __init__(self, logger=None, idle_timeout=60, airborne_airspeed=30, max_gap=10, checkpoint_interval=60):
+        self.logger = logger
+        self.idle_timeout = idle_timeout
+        self.airborne_airspeed = airborne_airspeed # knots
+        self.max_gap = max_gap # longest gap between two ticks credited as airborne time
+        self.checkpoint_interval = checkpoint_interval
+        self.sessions = {} # (accountID, force name) -> PatrolSession
+
+    @staticmethod
+    def create_indexes(collection):
+        collection.create_index([("force", 1), ("end_time", 1)])
+        collection.create_index([("force", 1), ("start_time", -1)])
+        collection.create_index([("accountID", 1), ("start_time", -1)])
+
+    @staticmethod
+    def close_stale(collection): # closes sessions left open by a previous run at the last time they were seen
+        result = collection.update_many(
+            {"end_time": None},
+            [{"$set": {"end_time": "$last_seen"}}]
+        )
+        return result.modified_count
+
+    def observe(self, players, matcher, now=None): # feeds one tick of online players
+        now = now or datetime.now()
+        ops = []
+        seen = set()
+        online = set()
+
+        for player in players:
+            uid = player.userInfo["id"]
+            cs = player.userInfo["callsign"]
+            online.add(uid)
+            for force in matcher.match(cs):
+                key = (uid, force["name"])
+                seen.add(key)
+                session = self.sessions.get(key)
+                if session is None:
+                    session = self.sessions[key] = PatrolSession(force, uid, cs, now)
+                    ops.append(self._open_op(session))
+                    self._log(f"Account ID: {uid} is patrolling for force {session.force}.")
+                    continue
+
+                if player.airspeed >= self.airborne_airspeed:
+                    session.airborne_seconds += min((now - session.last_seen).total_seconds(), self.max_gap)
+                session.last_seen = now
+                session.callsign = cs
+                if (now - session.last_checkpoint).total_seconds() >= self.checkpoint_interval:
+                    session.last_checkpoint = now
+                    ops.append(self._checkpoint_op(session))
+
+        for key, session in list(self.sessions.items()):
+            if key in seen:
+                continue
+            # online under a non matching callsign, or gone for longer than the timeout
+            if session.accountID in online or (now - session.last_seen).total_seconds() > self.idle_timeout:
+                ops.append(self._close(key))
+        return ops
+
+    def close_all(self): # closes every open session, used on shutdown
+        return [self._close(key) for key in list(self.sessions)]
+
+    def _close(self, key):
+        session = self.sessions.pop(key)
+        self._log(f"Account ID: {session.accountID} is no longer patrolling for force {session.force}.")
+        return UpdateOne(
+            {"_id": session._id},
+            {"$set": {
+                "callsign": session.callsign,
+                "last_seen": session.last_seen,
+                "airborne_seconds": session.airborne_seconds,
+                "end_time": session.last_seen,
+            }}
+        )
+
+    def _open_op(self, session):
+        return UpdateOne(
+            {"_id": session._id},
+            {
+                "$setOnInsert": {
+                    "force": session.force,
+                    "callsign_filter": session.callsign_filter,
+                    "accountID": session.accountID,
+                    "start_time": session.start_time,
+                    "end_time": None,
+                },
+                "$set": {
+                    "callsign": session.callsign,
+                    "last_seen": session.last_seen,
+                    "airborne_seconds": session.airborne_seconds,
+                },
+            },
+            upsert=True
+        )
+
+    def _checkpoint_op(self, session):
+        return UpdateOne(
+            {"_id": session._id},
+            {"$set": {
+                "callsign": session.callsign,
+                "last_seen": session.last_seen,
+                "airborne_seconds": session.airborne_seconds,
+            }}
+        )
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.log(20, message)
@@ -0,0 +1,50 @@
+from shared.timeBuckets import RESOLUTIONS, bucket_start, slot_update
+
+
+class PlayerCountRollups:
+    """
+    Online player count series at minute, hour and day resolution.
+
+    Every tick is a sample of the open minute, kept in memory. When the minute
+    closes it is merged into one slot of each resolution's period document:
+
+        {resolution: "minute", period: <hour>,  slots: {"0".."59": {samples, sum, min, max}}}
+        {resolution: "hour",   period: <day>,   slots: {"0".."23": ...}}
+        {resolution: "day",    period: <month>, slots: {"1".."31": ...}}
+
+    sum / samples is the mean count of a slot. A range is answered from the
+    period documents it overlaps without touching raw samples.
+    """
+    def __init__(self):
+        self.minute = None
+        self.samples = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def create_indexes(self, collection):
+        collection.create_index([("resolution", 1), ("period", 1)], unique=True)
+
+    def observe(self, count, now): # adds a sample, returns the ops for the minute it closed, if any
+        minute = bucket_start(now, "minute")
+        ops = self.close() if self.minute is not None and minute != self.minute else []
+        self.minute = minute
+        self.samples += 1
+        self.sum += count
+        self.min = count if self.min is None else min(self.min, count)
+        self.max = count if self.max is None else max(self.max, count)
+        return ops
+
+    def close(self): # ops merging the open minute into every resolution
+        if not self.samples:
+            return []
+        ops = [
+            slot_update(resolution, self.minute, self.samples, self.sum, self.min, self.max)
+            for resolution in RESOLUTIONS
+        ]
+        self.samples = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        return ops
+
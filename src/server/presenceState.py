@@ -0,0 +1,155 @@
+import numpy as np
+from datetime import datetime, timedelta
+
+
+class PilotState:
+    """Last known state of a single account."""
+    __slots__ = ("accountID", "callsign", "aircraft", "position", "online", "lastOnline")
+
+    def __init__(self, accountID, callsign=None, aircraft=None, position=None, online=False, lastOnline=None):
+        self.accountID = accountID
+        self.callsign = callsign
+        self.aircraft = aircraft
+        self.position = position
+        self.online = online
+        self.lastOnline = lastOnline
+
+
+class PresenceTransitions:
+    """Everything that changed between two ticks."""
+    def __init__(self):
+        self.new_accounts = []      # {'accountID', 'callsign'}
+        self.online = []            # {'accountID', 'callsign'}
+        self.offline = []           # {'accountID', 'callsign', 'lastOnline'}
+        self.teleports = []         # {'accountID', 'oldPosition', 'newPosition', 'distance', 'speed'}
+        self.aircraft_changes = []  # {'accountID', 'callsign', 'oldAircraft', 'newAircraft'}
+        self.callsign_changes = []  # {'accountID', 'oldCallsign', 'newCallsign'}
+
+
+class PresenceStateEngine:
+    """
+    Resident copy of the presence fields of the users collection.
+
+    The engine is warmed once from Mongo and afterwards every tick is diffed
+    against memory only, so detecting online, offline, teleport, callsign and
+    aircraft transitions costs no database round trips.
+    """
+    WARM_PROJECTION = {
+        "_id": 0,
+        "accountID": 1,
+        "currentCallsign": 1,
+        "currentAircraft": 1,
+        "lastPosition": 1,
+        "Online": 1,
+        "lastOnline": 1,
+    }
+
+    def __init__(self, offline_grace=timedelta(minutes=1), teleport_distance=50, teleport_speed=4000, min_teleport_distance=5):
+        self.offline_grace = offline_grace
+        self.teleport_distance = teleport_distance # km, used when the previous fix has no timestamp
+        self.teleport_speed = teleport_speed # km/h no aircraft can reach between two fixes
+        self.min_teleport_distance = min_teleport_distance # km, ignores jitter between close fixes
+        self.pilots = {}
+        self.online_ids = set()
+
+    def warm(self, user_collection): # loads the last known state of every account
+        self.pilots.clear()
+        self.online_ids.clear()
+        for doc in user_collection.find({}, self.WARM_PROJECTION):
+            state = PilotState(
+                doc["accountID"],
+                callsign=doc.get("currentCallsign"),
+                aircraft=doc.get("currentAircraft"),
+                position=doc.get("lastPosition"),
+                online=doc.get("Online", False),
+                lastOnline=doc.get("lastOnline"),
+            )
+            self.pilots[state.accountID] = state
+            if state.online:
+                self.online_ids.add(state.accountID)
+        return len(self.pilots)
+
+    def update(self, players, now=None): # diffs the current players against the resident state
+        now = now or datetime.now()
+        transitions = PresenceTransitions()
+        current_ids = set()
+        moved = [] # (state, old position, old time) of pilots with a previous position
+
+        for player in players:
+            uid = player.userInfo["id"]
+            cs = player.userInfo["callsign"]
+            ac = player.aircraft["type"]
+            current_ids.add(uid)
+
+            state = self.pilots.get(uid)
+            if state is None:
+                state = PilotState(uid)
+                self.pilots[uid] = state
+                transitions.new_accounts.append({"accountID": uid, "callsign": cs})
+            elif not state.online:
+                transitions.online.append({"accountID": uid, "callsign": cs})
+
+            if state.position:
+                moved.append((state, state.position, state.lastOnline))
+            # aircraft change
+            if state.aircraft and state.aircraft != ac:
+                transitions.aircraft_changes.append({"accountID": uid, "callsign": cs, "oldAircraft": state.aircraft, "newAircraft": ac})
+            # callsign change
+            if state.callsign and state.callsign != cs:
+                transitions.callsign_changes.append({"accountID": uid, "oldCallsign": state.callsign, "newCallsign": cs})
+
+            state.callsign = cs
+            state.aircraft = ac
+            state.position = player.coordinates
+            state.online = True
+            state.lastOnline = now
+            self.online_ids.add(uid)
+
+        # teleports, one vectorized pass over every pilot with a previous position
+        if moved:
+            old = np.array([position for _, position, _ in moved], dtype=float)
+            new = np.array([state.position for state, _, _ in moved], dtype=float)
+            elapsed = np.array([(now - then).total_seconds() if then else np.nan for _, _, then in moved])
+            distances, speeds = jump_metrics(old[:, 0], old[:, 1], new[:, 0], new[:, 1], elapsed)
+            # without a timestamp only the raw distance cutoff can be applied
+            teleported = np.where(
+                np.isnan(speeds),
+                distances >= self.teleport_distance,
+                (distances >= self.min_teleport_distance) & (speeds >= self.teleport_speed)
+            )
+            for i in np.flatnonzero(teleported):
+                state, position, _ = moved[i]
+                transitions.teleports.append({
+                    "accountID": state.accountID,
+                    "oldPosition": position,
+                    "newPosition": state.position,
+                    "distance": float(distances[i]),
+                    "speed": None if np.isnan(speeds[i]) else float(speeds[i]),
+                })
+
+        # pilots missing from the map for longer than the grace period go offline
+        for uid in self.online_ids - current_ids:
+            state = self.pilots[uid]
+            if state.lastOnline is None or now - state.lastOnline > self.offline_grace:
+                transitions.offline.append({"accountID": uid, "callsign": state.callsign, "lastOnline": state.lastOnline})
+        for pilot in transitions.offline:
+            self.pilots[pilot["accountID"]].online = False
+            self.online_ids.discard(pilot["accountID"])
+
+        return transitions
+
+
+def jump_metrics(old_lat, old_lon, new_lat, new_lon, elapsed): # haversine distance in km and implied ground speed in km/h
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (old_lat, old_lon, new_lat, new_lon))
+
+    # harversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    # radius of earth
+    R = 6371
+    distances = c * R
+    hours = np.maximum(elapsed, 1e-3) / 3600
+    return distances, distances / hours
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+
+class Cadence:
+    """
+    Fixed-rate timer for one collector task.
+
+    Ticks are due at start + k * period on the monotonic clock, so time spent
+    doing the work does not push later ticks back. When the work overruns by
+    one or more whole periods the missed ticks are skipped and coalesced into
+    a single late tick rather than fired back to back.
+    """
+    def __init__(self, name, period, start_delay=0):
+        self.name = name
+        self.period = period
+        self.start_delay = start_delay
+        self.next_due = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.overruns = 0 # ticks that started late because the previous one ran long
+        self.skipped = 0  # ticks coalesced away
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+
+    async def wait(self): # sleeps until the next tick is due
+        now = time.monotonic()
+        if self.next_due is None:
+            self.next_due = now + self.start_delay
+        elif now >= self.next_due + self.period:
+            missed = int((now - self.next_due) // self.period)
+            self.skipped += missed
+            self.next_due += missed * self.period
+
+        if now > self.next_due:
+            self.overruns += 1
+        else:
+            await asyncio.sleep(self.next_due - now)
+
+        jitter = max(time.monotonic() - self.next_due, 0)
+        self.ticks += 1
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.next_due += self.period
+
+    def stats(self):
+        return {
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "mean_jitter_ms": round(self.jitter_total / self.ticks * 1000, 2) if self.ticks else 0,
+            "max_jitter_ms": round(self.jitter_max * 1000, 2),
+        }
+
+
+class CadenceScheduler:
+    """Registry of the collector cadences and their timing statistics."""
+    def __init__(self):
+        self.cadences = {}
+
+    def add(self, name, period, start_delay=0):
+        self.cadences[name] = Cadence(name, period, start_delay)
+        return self.cadences[name]
+
+    def report(self): # returns the stats of every cadence since the last report and resets them
+        report = {}
+        for name, cadence in self.cadences.items():
+            report[name] = cadence.stats()
+            cadence.reset_stats()
+        return report
@@ -0,0 +1,59 @@
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import os
+import time
+
+# One-shot cleanup of duplicate user documents.
+# The collector runs it at startup until the unique accountID index exists, after
+# which Mongo itself rejects duplicates. Run this file directly to clean up on demand.
+
+def has_unique_account_index(user_collection): # checks if the unique accountID index is in place
+    for index in user_collection.index_information().values():
+        if index.get("key") == [("accountID", 1)] and index.get("unique"):
+            return True
+    return False
+
+def remove_duplicate_users(user_collection, log=print, report_every=100, removed_log="removed_users.txt"):
+    pipeline = [
+        {"$group": {"_id": "$accountID", "count": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    start = time.time()
+    groups = 0
+    removed = 0
+    kept = 0
+    with open(removed_log, "a") as f:
+        # the cursor is streamed, duplicates are never loaded all at once
+        for duplicate in user_collection.aggregate(pipeline, allowDiskUse=True):
+            groups += 1
+            for _id in sorted(duplicate["ids"])[1:]:
+                user = user_collection.find_one({"_id": _id}, {"events": {"$slice": 1}})
+                if user is None:
+                    continue
+                if user.get("events"): # unmigrated history is never thrown away
+                    kept += 1
+                    continue
+                user_collection.delete_one({"_id": _id})
+                f.write(f"Removed duplicate user with accountID {duplicate['_id']} and _id {_id}\n")
+                removed += 1
+            if groups % report_every == 0:
+                log(f"Checked {groups} duplicated accounts, removed {removed} documents ({round(time.time() - start)}s)")
+
+    log(f"Duplicate cleanup done. {groups} duplicated accounts, removed {removed} documents, kept {kept} with unmigrated events ({round(time.time() - start)}s)")
+    return removed
+
+def get_mongo_uri():
+    DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
+    DATABASE_NAME = os.getenv('DATABASE_NAME')
+    DATABASE_IP = os.getenv('DATABASE_IP')
+    DATABASE_USER = os.getenv('DATABASE_USER')
+    return f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
+
+if __name__ == "__main__":
+    load_dotenv()
+    client = MongoClient(get_mongo_uri())
+    users = client[os.getenv('DATABASE_NAME')]["users"]
+    remove_duplicate_users(users)
+    if not has_unique_account_index(users):
+        users.create_index("accountID", unique=True)
+        print("Created unique accountID index.")
@@ -0,0 +1,49 @@
+from pymongo import UpdateOne
+
+
+class UserWriteCoalescer:
+    """
+    Coalesces per-tick user upserts into delta-only updates.
+
+    Keeps the values last written for every account and only emits the fields
+    that actually changed. lastOnline/lastPosition are refreshed every
+    refresh_interval seconds, or whenever the account is written anyway.
+    """
+    TRACKED_FIELDS = ("currentCallsign", "currentAircraft", "Online")
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.written = {} # accountID -> last written values
+        self.pending = {} # accountID -> {'set': {...}}
+
+    def stage(self, accountID, now, position=None, **fields): # records a tick's view of an account
+        written = self.written.setdefault(accountID, {})
+        pending = self.pending.get(accountID)
+
+        dirty = {key: value for key, value in fields.items() if key not in written or written[key] != value}
+        stale = "lastOnline" not in written or (now - written["lastOnline"]).total_seconds() >= self.refresh_interval
+        if not dirty and not stale:
+            return
+
+        if pending is None:
+            pending = self.pending[accountID] = {"set": {}}
+        pending["set"].update(dirty)
+        pending["set"]["lastOnline"] = now
+        if position is not None:
+            pending["set"]["lastPosition"] = position
+
+    def drain(self): # returns the coalesced updates and marks them as written
+        ops = []
+        for accountID, pending in self.pending.items():
+            update = {"$setOnInsert": {"accountID": accountID}, "$set": pending["set"]}
+            if "currentCallsign" in pending["set"]:
+                update["$addToSet"] = {"pastCallsigns": pending["set"]["currentCallsign"]}
+            ops.append(UpdateOne({"accountID": accountID}, update, upsert=True))
+
+            written = self.written[accountID]
+            for key in self.TRACKED_FIELDS:
+                if key in pending["set"]:
+                    written[key] = pending["set"][key]
+            written["lastOnline"] = pending["set"]["lastOnline"]
+        self.pending = {}
+        return ops
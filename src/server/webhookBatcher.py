@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from collections import deque, defaultdict
+
+
+class WebhookBatcher:
+    """
+    Batches notifications for the bot and posts them from a background thread.
+
+    The thread blocks on the queue instead of polling it. Once the first item of
+    a batch arrives it drains everything already queued and keeps collecting
+    until max_batch_size items or max_linger seconds after that first item,
+    then posts one request per destination url. While the receiver answers
+    503/429 the thread waits and retries, so the queue fills up and the
+    overflow policy applies backpressure to the collector.
+
+    The queue is bounded. When it is full, overflow decides what happens:
+        "drop_oldest": the oldest queued item is discarded (default)
+        "drop_newest": the new item is discarded
+        "block":       the caller waits up to block_timeout seconds, then the new item is discarded
+    """
+    def __init__(self, name, session, logger, max_batch_size=50, max_linger=0.5, max_queue_size=5000, overflow="drop_oldest", block_timeout=1, send_timeout=5, max_busy_retries=5):
+        self.name = name
+        self.session = session
+        self.logger = logger
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.send_timeout = send_timeout
+        self.max_busy_retries = max_busy_retries
+        self.queue = queue.Queue(maxsize=max_queue_size)
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000) # seconds from submit to delivery
+
+        self.thread = threading.Thread(target=self._run, name=f"WebhookBatcher-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, url, data): # queues a notification, applying the overflow policy when full
+        item = (time.monotonic(), url, data)
+        if self.overflow == "block":
+            try:
+                self.queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self.dropped += 1
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow != "drop_oldest":
+                    return
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.queue.qsize(),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "p50_latency_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0,
+            "p95_latency_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0,
+            "max_latency_ms": round(latencies[-1] * 1000, 1) if latencies else 0,
+        }
+
+    def _collect(self): # blocks for the first item, then fills the batch until it is full or the linger deadline passes
+        batch = [self.queue.get()]
+        deadline = batch[0][0] + self.max_linger
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._collect()
+                by_url = defaultdict(list)
+                for item in batch:
+                    by_url[item[1]].append(item)
+                for url, items in by_url.items():
+                    self._send(url, items)
+            except Exception as e:
+                self.logger.log(40, f"Error processing {self.name} queue: {e}")
+                time.sleep(1)
+
+    def _send(self, url, items):
+        try:
+            response = self.session.post(url, json=[data for _, _, data in items], timeout=self.send_timeout)
+            for _ in range(self.max_busy_retries): # the bot answers 503 while it is behind, wait instead of dropping
+                if response.status_code not in (429, 503):
+                    break
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                response = self.session.post(url, json=[data for _, _, data in items], timeout=self.send_timeout)
+            if response.status_code != 204:
+                self.failed += len(items)
+                self.logger.log(30, f"Batch send to {url} failed. Status code: {response.status_code}")
+                return
+        except Exception as e:
+            self.failed += len(items)
+            self.logger.log(40, f"Batch send to {url} failed. Error: {e}")
+            return
+        now = time.monotonic()
+        self.sent += len(items)
+        self.latencies.extend(now - submitted for submitted, _, _ in items)
@@ -0,0 +1,179 @@
+import aiohttp
+import asyncio
+import json
+import random
+import time
+from .http_client import log, metrics, retry_budget, breaker_for, _gave_up
+
+# The asyncio twin of http_client: one keep-alive aiohttp session per process,
+# with the same deadline, retry budget and circuit breakers as safe_post, so a
+# GeoFS outage trips the same breaker whichever client noticed it. Timings go
+# to http_client.metrics; aiohttp does not report the TLS handshake on its
+# own, it is counted in connect.
+
+_session = None
+
+
+async def _on_request_start(session, ctx, params):
+    ctx.reused = True # until a new connection is opened for it
+    ctx.sent = None
+
+async def _on_dns_resolvehost_start(session, ctx, params):
+    ctx.dns_start = time.perf_counter()
+
+async def _on_dns_resolvehost_end(session, ctx, params):
+    ctx.dns = time.perf_counter() - ctx.dns_start
+    metrics.record("dns", ctx.dns)
+
+async def _on_connection_create_start(session, ctx, params):
+    ctx.reused = False
+    ctx.dns = 0
+    ctx.connect_start = time.perf_counter()
+
+async def _on_connection_create_end(session, ctx, params):
+    metrics.record("connect", time.perf_counter() - ctx.connect_start - ctx.dns)
+    with metrics.lock:
+        metrics.connections += 1
+
+async def _on_request_headers_sent(session, ctx, params):
+    ctx.sent = time.perf_counter()
+
+async def _on_request_end(session, ctx, params): # fires once the response headers arrived
+    if ctx.sent is not None:
+        metrics.record("ttfb", time.perf_counter() - ctx.sent)
+    with metrics.lock:
+        metrics.requests += 1
+        metrics.reused += ctx.reused
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_on_request_start)
+    trace.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace.on_connection_create_start.append(_on_connection_create_start)
+    trace.on_connection_create_end.append(_on_connection_create_end)
+    trace.on_request_headers_sent.append(_on_request_headers_sent)
+    trace.on_request_end.append(_on_request_end)
+    return trace
+
+
+def get_session(limit_per_host: int = 4) -> aiohttp.ClientSession:
+    """
+    The shared session, created on first use inside the running event loop.
+
+    At most limit_per_host connections are open per host, idle ones are kept
+    for 30 seconds. Cookies are never stored, every client passes its own.
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=limit_per_host, keepalive_timeout=30, ttl_dns_cache=300),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[_trace_config()],
+        )
+    return _session
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+async def safe_post_async(
+    url: str,
+    payload: dict,
+    timeout: tuple[float, float] = (5, 15),
+    max_json_retries: int = 2,
+    deadline: float = 10,
+    backoff_base: float = 0.25,
+    backoff_cap: float = 2,
+    verify: bool = True,
+    cookies: dict | None = None,
+) -> dict | None:
+    """
+    POST a JSON payload, giving up after deadline seconds. Behaves like
+    http_client.safe_post without blocking the event loop.
+
+    • A request on a pooled socket the server already closed is re-sent once at once
+    • Returns parsed JSON on success, or None on total failure
+    """
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        with metrics.lock:
+            metrics.short_circuited += 1
+        return None
+
+    try:
+        session = get_session()
+        end = time.monotonic() + deadline
+        retry_budget.deposit()
+        resent = False
+        attempt = 0
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0: # a resend after a stale socket skips the back-off check, and a zero total would disable the timeout
+                return _gave_up(breaker, url, f"deadline of {deadline}s reached after {attempt + 1} attempts")
+            try:
+                async with session.post(
+                    url,
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=remaining, sock_connect=min(timeout[0], remaining), sock_read=min(timeout[1], remaining)),
+                    ssl=verify,
+                    cookies=cookies,
+                ) as resp:
+                    text = await resp.text()
+                    if text != "":
+                        resp.raise_for_status()
+                        body = json.loads(text)
+                        breaker.success()
+                        return body
+                    log.error("Response is None, no JSON to parse")
+                    breaker.success() # the host answered, it is not down
+                    return None
+
+            # ---------- a stale keep-alive socket ---------------------------------
+            except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError) as stale:
+                if not resent and not isinstance(stale, aiohttp.ClientConnectorError): # connect failures are not stale sockets
+                    resent = True
+                    with metrics.lock:
+                        metrics.stale += 1
+                    continue
+                log.error("%s on attempt %d: %s", type(stale).__name__, attempt + 1, stale)
+
+            # ---------- retry on bad JSON -----------------------------------------
+            except json.JSONDecodeError as jde:
+                log.error("Failed to parse JSON from %s (status %d): %s", url, resp.status, jde)
+                log.error("Response text repr: %r", text)
+
+            # ---------- client errors won't go away by retrying -------------------
+            except aiohttp.ClientResponseError as cre:
+                if cre.status < 500 and cre.status != 429:
+                    log.error("safe_post_async: %s", cre)
+                    breaker.success()
+                    return None
+                log.error("ClientResponseError on attempt %d: %s", attempt + 1, cre)
+
+            # ---------- retry on network errors -----------------------------------
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.error("%s on attempt %d: %s", type(e).__name__, attempt + 1, e)
+
+            # ---------- back-off before the next loop iteration -------------------
+            if attempt == max_json_retries:
+                break
+            sleep_sec = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt)) # full jitter
+            if time.monotonic() + sleep_sec >= end:
+                return _gave_up(breaker, url, f"deadline of {deadline}s reached after {attempt + 1} attempts")
+            if not retry_budget.withdraw():
+                return _gave_up(breaker, url, f"retry budget exhausted after {attempt + 1} attempts")
+            with metrics.lock:
+                metrics.retries += 1
+            log.info("Sleeping %.2fs before retry", sleep_sec)
+            await asyncio.sleep(sleep_sec)
+            attempt += 1
+
+        # All retries failed
+        return _gave_up(breaker, url, f"{max_json_retries + 1} attempts failed")
+    except BaseException: # anything unhandled (cancellation, a decode error) still settles a half open trial
+        breaker.failure()
+        raise
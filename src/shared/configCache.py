@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+VERSION_FIELD = "configVersion" # bumped by every write so readers only have to compare one field
+
+DEFAULT_CONFIG = {
+    "saveChatMessages": True,
+    "accumulateHeatMap": True,
+    "storeUsers": True,
+    "callsignChangeLogChannel": None,
+    "newAccountLogChannel": None,
+    "aircraftChangeLogChannel": None,
+    "displayCallsignChanges": True,
+    "displayNewAccounts": True,
+    "displayAircraftChanges": True,
+    "countUsers": True,
+    "logAircraftDistributions": True,
+    "logAircraftChanges": True,
+    "logMRPActivity": True,
+    "forcesVersion": 0,
+    VERSION_FIELD: 0,
+}
+
+WATCH_PIPELINE = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+WATCH_RETRY = (5, 300) # seconds before reopening a change stream, doubled after every failed attempt up to the maximum
+
+def toggle_update(key): # flips a boolean setting server side, no read-modify-write
+    return [{"$set": {
+        key: {"$not": [f"${key}"]},
+        VERSION_FIELD: {"$add": [{"$ifNull": [f"${VERSION_FIELD}", 0]}, 1]},
+    }}]
+
+def set_update(values): # sets settings and bumps the version
+    return {"$set": values, "$inc": {VERSION_FIELD: 1}}
+
+def version_bump():
+    return {"$inc": {VERSION_FIELD: 1}}
+
+def changed_settings(old, new): # settings whose value differs between two versions of the document
+    return {key: value for key, value in new.items() if key != "_id" and (old or {}).get(key) != value}
+
+def missing_and_stale(configuration): # settings to add and settings to remove to match DEFAULT_CONFIG
+    missing = {key: value for key, value in DEFAULT_CONFIG.items() if key not in configuration}
+    stale = [key for key in configuration if key not in DEFAULT_CONFIG and key != "_id"]
+    return missing, stale
+
+
+class ConfigCache:
+    """
+    In-memory copy of the configurations document for synchronous code.
+
+    Listeners are called with (config, changed) whenever a new version shows up.
+    watch() follows a change stream when Mongo runs as a replica set; without
+    one, poll() reads only the version field and reloads the document when it
+    moved. refresh() polls only while no stream is open and tries to reopen
+    one with backoff.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.config = None
+        self.version = None
+        self.listeners = []
+        self.watching = False
+        self.watch_retry = WATCH_RETRY[0]
+        self.next_watch = 0 # monotonic time of the next attempt to open a change stream
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def ensure_defaults(self, log=print): # inserts the defaults or reconciles the stored document with them
+        configuration = self.collection.find_one()
+        if configuration is None:
+            self.collection.insert_one(dict(DEFAULT_CONFIG))
+        else:
+            missing, stale = missing_and_stale(configuration)
+            if missing:
+                log(f"Found new configuration settings {list(missing)}. Adding them to the database.")
+            if stale:
+                log(f"Found old configuration settings {stale}. Removing them from the database.")
+            if missing or stale:
+                update = version_bump() # also creates the version field when it is missing
+                missing.pop(VERSION_FIELD, None)
+                if missing:
+                    update["$set"] = missing
+                if stale:
+                    update["$unset"] = {key: "" for key in stale}
+                self.collection.update_one({"_id": configuration["_id"]}, update)
+        return self.load()
+
+    def load(self):
+        self._apply(self.collection.find_one())
+        return self.config
+
+    def poll(self): # cheap check, the full document is only read when the version moved
+        stamp = self.collection.find_one({}, {VERSION_FIELD: 1})
+        if stamp is not None and stamp.get(VERSION_FIELD) != self.version:
+            self.load()
+
+    def _watch_attempted(self, opened): # schedules the next attempt, soon after a stream that worked, later after each failure
+        self.watch_retry = WATCH_RETRY[0] if opened else min(self.watch_retry * 2, WATCH_RETRY[1])
+        self.next_watch = time.monotonic() + self.watch_retry
+
+    def refresh(self): # keeps the cache fresh from a periodic caller
+        if self.watching:
+            return
+        if time.monotonic() >= self.next_watch:
+            self._watch_attempted(self.watch())
+        self.poll() # also picks up changes made before a reopened stream started
+
+    def watch(self): # follows a change stream on a background thread, False when change streams are unavailable
+        try:
+            stream = self.collection.watch(WATCH_PIPELINE, full_document="updateLookup")
+        except PyMongoError:
+            return False
+        self.watching = True
+        threading.Thread(target=self._follow, args=(stream,), name="ConfigCache", daemon=True).start()
+        return True
+
+    def _follow(self, stream):
+        try:
+            with stream:
+                for change in stream:
+                    self._apply(change.get("fullDocument"))
+        except PyMongoError:
+            pass
+        self.watching = False # callers go back to polling
+
+    def _apply(self, configuration):
+        if configuration is None:
+            return
+        old = self.config
+        changed = changed_settings(old, configuration)
+        self.config = configuration
+        self.version = configuration.get(VERSION_FIELD)
+        if old is not None and changed:
+            for listener in self.listeners:
+                listener(configuration, changed)
+
+
+class AsyncConfigCache(ConfigCache):
+    """
+    ConfigCache for an async (Motor) collection. run() keeps the cache fresh,
+    on a change stream when possible and a version poll while none is open.
+    """
+    async def load(self):
+        self._apply(await self.collection.find_one())
+        return self.config
+
+    async def poll(self):
+        stamp = await self.collection.find_one({}, {VERSION_FIELD: 1})
+        if stamp is not None and stamp.get(VERSION_FIELD) != self.version:
+            await self.load()
+
+    async def watch(self): # returns when change streams are unavailable or the stream broke, True if it had opened
+        opened = False
+        try:
+            async with self.collection.watch(WATCH_PIPELINE, full_document="updateLookup") as stream:
+                self.watching = True
+                opened = True
+                await self.load() # changes made before the stream opened
+                async for change in stream:
+                    self._apply(change.get("fullDocument"))
+        except PyMongoError:
+            pass
+        finally:
+            self.watching = False
+        return opened
+
+    async def run(self, interval=1):
+        while True:
+            if time.monotonic() >= self.next_watch:
+                self._watch_attempted(await self.watch())
+            try:
+                await self.poll()
+            except PyMongoError:
+                pass
+            await asyncio.sleep(interval)
+
+    async def toggle(self, key): # flips a boolean setting atomically and returns its new value
+        configuration = await self.collection.find_one_and_update({}, toggle_update(key), return_document=ReturnDocument.AFTER)
+        self._apply(configuration)
+        return configuration[key]
+
+    async def set(self, values):
+        configuration = await self.collection.find_one_and_update({}, set_update(values), upsert=True, return_document=ReturnDocument.AFTER)
+        self._apply(configuration)
+        return configuration
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+
+SEGMENT_SUFFIX = ".log"
+OFFSET_SUFFIX = ".offset"
+
+
+def list_segments(directory): # returns the segment numbers in the directory, oldest first
+    segments = []
+    for name in os.listdir(directory):
+        if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+            segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+    return sorted(segments)
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"{segment:020d}{SEGMENT_SUFFIX}")
+
+def committed_segments(directory): # returns the segment of every consumer's committed offset
+    segments = []
+    for name in os.listdir(directory):
+        if not name.endswith(OFFSET_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                segments.append(json.load(f)["segment"])
+        except (OSError, ValueError, KeyError):
+            continue
+    return segments
+
+
+class EventLogWriter:
+    """
+    Append-only event log made of numbered JSON-lines segment files.
+
+    Every append writes the whole batch with a single write and fsync, so a
+    batch is either fully on disk or, after a crash, cut off at a line the
+    reader ignores. Segments roll over at segment_bytes and only the newest
+    retain_segments are kept, except that a segment a consumer has not
+    committed past yet is never removed.
+    """
+    def __init__(self, directory="../../data/eventlog", segment_bytes=16 * 1024 * 1024, retain_segments=32):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retain_segments = retain_segments
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = list_segments(directory)
+        self.segment = segments[-1] if segments else 1
+        self.file = open(segment_path(directory, self.segment), "ab")
+
+    def append(self, events): # appends a batch of {'type', 'data'} events
+        if not events:
+            return
+        now = time.time()
+        payload = b"".join(
+            json.dumps({"type": event["type"], "data": event.get("data"), "time": now}, default=str).encode() + b"\n"
+            for event in events
+        )
+        with self.lock:
+            self.file.write(payload)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if self.file.tell() >= self.segment_bytes:
+                self._roll()
+
+    def _roll(self):
+        self.file.close()
+        self.segment += 1
+        self.file = open(segment_path(self.directory, self.segment), "ab")
+        committed = committed_segments(self.directory)
+        for segment in list_segments(self.directory)[:-self.retain_segments]:
+            if committed and segment >= min(committed):
+                break
+            os.remove(segment_path(self.directory, segment))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class EventLogReader:
+    """
+    Tails an EventLogWriter log from a persisted consumer offset.
+
+    read_batch returns the next events and the offset after them; the offset
+    is only persisted when commit is called, so events handed out but not
+    committed are read again after a restart.
+    """
+    def __init__(self, directory="../../data/eventlog", consumer="bot"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.offset_path = os.path.join(directory, f"{consumer}{OFFSET_SUFFIX}")
+        self.offset = self._load_offset()
+
+    def _load_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                offset = json.load(f)
+            return (offset["segment"], offset["position"])
+        except (OSError, ValueError, KeyError):
+            segments = list_segments(self.directory)
+            return (segments[0] if segments else 1, 0)
+
+    def read_batch(self, max_events=500): # returns (events, offset after them)
+        segment, position = self.offset
+        events = []
+        while len(events) < max_events:
+            path = segment_path(self.directory, segment)
+            if not os.path.exists(path):
+                newer = [s for s in list_segments(self.directory) if s > segment]
+                if not newer:
+                    break
+                segment, position = newer[0], 0 # our segment was pruned, continue at the oldest one left
+                continue
+
+            with open(path, "rb") as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"): # still being written
+                        break
+                    position += len(line)
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        continue
+                    if len(events) >= max_events:
+                        break
+
+            if len(events) >= max_events:
+                break
+            newer = [s for s in list_segments(self.directory) if s > segment]
+            if not newer or os.path.getsize(path) > position:
+                break
+            segment, position = newer[0], 0
+        self.offset = (segment, position)
+        return events, self.offset
+
+    def commit(self, offset): # persists the consumer offset atomically
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": offset[0], "position": offset[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
@@ -0,0 +1,97 @@
+import numpy as np
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from .timeBuckets import bucket_start
+
+# Player positions are counted per grid cell per day instead of being stored one
+# document per pilot. Every position is counted on each level of a cell pyramid,
+# from 4 degree cells down to 1/16 degree cells, so a heatmap of any area reads
+# about the same number of cells: the level whose cells match the requested
+# resolution. Cells carry their center in loc for the 2d index.
+# Every position is also counted per month and all time, a window is read from
+# the coarsest counters covering it: days up to the first whole month, months
+# after that, so reads stay bounded however much history there is.
+
+LEVEL_DEGREES = [4, 2, 1, 0.5, 0.25, 0.125, 0.0625]
+WORLD = (-180, -90, 180, 90) # west, south, east, north
+SPANS = ("day", "month", "all")
+ALL_TIME = datetime(1970, 1, 1) # day of the all time counters
+
+def day_bucket(moment): # midnight of the day a sample belongs to
+    return datetime(moment.year, moment.month, moment.day)
+
+def span_start(moment, span): # start of the day, month or all time bucket a sample belongs to
+    return ALL_TIME if span == "all" else bucket_start(moment, span)
+
+def grid_size(level): # (columns, rows) of a level
+    return int(360 / LEVEL_DEGREES[level]), int(180 / LEVEL_DEGREES[level])
+
+def cell_indices(latitudes, longitudes, level): # grid column (x) and row (y) of every position on a level
+    degrees = LEVEL_DEGREES[level]
+    columns, rows = grid_size(level)
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    x = np.clip(np.floor((longitudes + 180) / degrees), 0, columns - 1).astype(int)
+    y = np.clip(np.floor((latitudes + 90) / degrees), 0, rows - 1).astype(int)
+    return x, y
+
+def cell_counts(latitudes, longitudes, level): # positions per occupied cell, {(x, y): count}
+    if len(latitudes) == 0:
+        return {}
+    x, y = cell_indices(latitudes, longitudes, level)
+    cells, inverse = np.unique(np.stack([x, y], axis=1), axis=0, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), minlength=len(cells))
+    return {(int(cx), int(cy)): int(count) for (cx, cy), count in zip(cells, counts)}
+
+def cell_centers(x, y, level): # (longitudes, latitudes) of the centers of the given cells
+    degrees = LEVEL_DEGREES[level]
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return x * degrees - 180 + degrees / 2, y * degrees - 90 + degrees / 2
+
+def cell_updates(latitudes, longitudes, moment): # upserts adding the positions to the day, month and all time counters on every level
+    ops = []
+    for level in range(len(LEVEL_DEGREES)):
+        for (x, y), count in cell_counts(latitudes, longitudes, level).items():
+            longitude, latitude = cell_centers(x, y, level)
+            for span in SPANS:
+                ops.append(UpdateOne(
+                    {"level": level, "span": span, "day": span_start(moment, span), "x": x, "y": y},
+                    {"$inc": {"count": count}, "$setOnInsert": {"loc": [float(longitude), float(latitude)]}},
+                    upsert=True
+                ))
+    return ops
+
+def create_indexes(collection):
+    collection.create_index([("level", 1), ("span", 1), ("day", 1), ("x", 1), ("y", 1)], unique=True)
+    collection.create_index([("loc", "2d"), ("level", 1), ("span", 1), ("day", 1)])
+
+def window_query(since=None): # filter selecting the coarsest counters that cover since until now, all time when None
+    if since is None:
+        return {"span": "all"}
+    since = day_bucket(since)
+    if since.day == 1:
+        return {"span": "month", "day": {"$gte": since}}
+    first_month = bucket_start(since.replace(day=28) + timedelta(days=4), "month")
+    return {"$or": [
+        {"span": "day", "day": {"$gte": since, "$lt": first_month}},
+        {"span": "month", "day": {"$gte": first_month}},
+    ]}
+
+def validate_bbox(bbox): # returns an error message for an unusable (west, south, east, north) box, or None
+    west, south, east, north = bbox
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        return "The box must satisfy -180 <= west < east <= 180 and -90 <= south < north <= 90."
+    return None
+
+def level_for(bbox, bins=100): # coarsest level giving at least bins cells across the box
+    west, south, east, north = bbox
+    target = max(east - west, (north - south) * 2) / bins
+    for level, degrees in enumerate(LEVEL_DEGREES):
+        if degrees <= target:
+            return level
+    return len(LEVEL_DEGREES) - 1
+
+def bbox_query(bbox): # geo filter matching the cells centered inside the box
+    west, south, east, north = bbox
+    return {"$geoWithin": {"$box": [[west, south], [east, north]]}}
@@ -1,7 +1,10 @@
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib.parse import urlsplit
+from collections import deque
 import json
+import random
+import threading
 import time
 import logging
 import traceback
@@ -14,92 +17,240 @@ handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
 log.addHandler(handler)
 
+PHASES = ("dns", "connect", "ttfb")
 
-def make_session() -> requests.Session:
-    """Create a Session with a urllib3 Retry on POST + Connection: close."""
-    s = requests.Session()
 
-    retry_cfg = Retry(
-        total=5,                    # 1 attempt + 5 retries
-        backoff_factor=1,           # delays: 1s, 2s, 4s, 8s, 16s
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["POST"],   # only retry POST
-        raise_on_status=False,      # let us handle HTTPError manually
-        respect_retry_after_header=True,
-    )
-    adapter = HTTPAdapter(max_retries=retry_cfg)
-    s.mount("https://", adapter)
+class HTTPMetrics:
+    """
+    Timings of the requests made through the shared aiohttp session, in
+    seconds, recorded by its trace hooks.
+
+    dns and connect are only recorded when a request had to open a new
+    connection, connect includes the TLS handshake; ttfb is recorded for
+    every request. reused counts requests served on a pooled keep-alive
+    connection.
+    """
+    def __init__(self, samples=1000):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.reused = 0
+        self.connections = 0
+        self.stale = 0 # requests re-sent because the server had closed their pooled connection
+        self.retries = 0
+        self.gave_up = 0 # calls that returned None after their attempts, deadline or retry budget ran out
+        self.short_circuited = 0 # calls failed at once by an open circuit breaker
+        self.timings = {phase: deque(maxlen=samples) for phase in PHASES}
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.timings[phase].append(seconds)
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "requests": self.requests,
+                "reused": self.reused,
+                "connections": self.connections,
+                "stale": self.stale,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "short_circuited": self.short_circuited,
+            }
+            for phase in PHASES:
+                timings = sorted(self.timings[phase])
+                stats[f"p50_{phase}_ms"] = round(timings[len(timings) // 2] * 1000, 2) if timings else 0
+                stats[f"p95_{phase}_ms"] = round(timings[int(len(timings) * 0.95)] * 1000, 2) if timings else 0
+        return stats
+
+
+metrics = HTTPMetrics()
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every call. Each call adds ratio tokens, each retry
+    spends one, so retries stay a fraction of the traffic however many calls
+    fail at once instead of multiplying the load on a struggling upstream.
+    """
+    def __init__(self, ratio=0.2, max_tokens=10):
+        self.lock = threading.Lock()
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self): # False when no retry is left in the budget
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a host at once after failure_threshold failed calls in a
+    row. After reset_timeout seconds one trial call is let through: success
+    closes the breaker, failure opens it for another reset_timeout.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False # a half open trial call is in flight
 
-    # avoid stale TLS sockets
-    s.headers.update({"Connection": "close"})
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                log.info("Circuit closed, upstream is back")
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log.error("Circuit opened after %d failed calls", self.failures)
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+def make_session(pool_maxsize: int = 4) -> requests.Session:
+    """
+    Create a Session with a keep-alive pool.
+
+    At most pool_maxsize idle connections are kept per host; requests beyond
+    that open a connection that is closed once it is returned. urllib3 does
+    not retry anything, every retry is left to safe_post.
+    """
+    s = requests.Session()
+    adapter = HTTPAdapter(max_retries=0, pool_connections=2, pool_maxsize=pool_maxsize)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 
-# one shared session for your entire process
+# one shared session, retry budget and set of circuit breakers for your entire process
 _session = make_session()
+retry_budget = RetryBudget()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(url: str) -> CircuitBreaker: # one breaker per host
+    host = urlsplit(url).netloc
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker()
+        return _breakers[host]
+
+def _gave_up(breaker, url, reason):
+    breaker.failure()
+    with metrics.lock:
+        metrics.gave_up += 1
+    log.error("safe_post: gave up on %s, %s", url, reason)
+    return None
 
 def safe_post(
     url: str,
     payload: dict,
-    timeout: tuple[int, int] = (5, 15),
+    timeout: tuple[float, float] = (5, 15),
     max_json_retries: int = 2,
-    reset_session_on_error: bool = True,
+    deadline: float = 10,
+    backoff_base: float = 0.25,
+    backoff_cap: float = 2,
     **request_kwargs,            #  <-- forward anything else (cookies, headers…)
 ) -> dict | None:
     """
-    POST a JSON payload with robust retries.
+    POST a JSON payload, giving up after deadline seconds.
 
-    • First layer of retries comes from urllib3.Retry inside _session
-    • Second layer retries JSON-parse errors or exhausted network failures
-    • Optionally rebuilds the Session if we suspect a stale socket
+    • Attempts get the (connect, read) timeout cut to what is left of the deadline
+    • Retries wait a full jitter backoff and spend the shared retry budget
+    • No retry is started when its backoff would end past the deadline
+    • While the host's circuit breaker is open the call fails at once
     • Returns parsed JSON on success, or None on total failure
     """
-    global _session
-
-    for attempt in range(max_json_retries + 1):
-        try:
-            resp = _session.post(
-                url,
-                json=payload,
-                timeout=timeout,
-                **request_kwargs
-            )
-            if resp.text != "":
-                resp.raise_for_status()
-                return resp.json()
-            else:
-                log.error(f"resp: {str(type(resp))}")
-                log.error(f"resp.text: {str(type(resp.text))}")
-                log.error("Response is None, no JSON to parse")
-                return None
-            
-        # ---------- retry on bad JSON -----------------------------------------
-        except json.JSONDecodeError as jde:
-            log.error("Failed to parse JSON from %s (status %d): %s",
-              url, resp.status_code, jde)
-            
-            log.error("Response text repr: %r", resp.text)
-            traceback.print_exc()
-
-        # ---------- retry on network / HTTP errors ----------------------------
-        except requests.RequestException as re:
-            log.error("RequestException on attempt %d: %s", attempt + 1, re)
-            traceback.print_exc()
-
-            if reset_session_on_error:
-                log.info("Re-initialising HTTP session (possible stale socket)")
-                try:
-                    _session.close()
-                except Exception:
-                    pass
-                _session = make_session()
-
-        # ---------- back-off before the next loop iteration -------------------
-        if attempt < max_json_retries:
-            sleep_sec = 2 ** attempt            # 1 s, 2 s, 4 s …
-            log.info("Sleeping %ds before retry", sleep_sec)
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        with metrics.lock:
+            metrics.short_circuited += 1
+        return None
+
+    try:
+        end = time.monotonic() + deadline
+        retry_budget.deposit()
+        for attempt in range(max_json_retries + 1):
+            remaining = end - time.monotonic()
+            try:
+                resp = _session.post(
+                    url,
+                    json=payload,
+                    timeout=(min(timeout[0], remaining), min(timeout[1], remaining)),
+                    **request_kwargs
+                )
+                if resp.text != "":
+                    resp.raise_for_status()
+                    body = resp.json()
+                    breaker.success()
+                    return body
+                else:
+                    log.error(f"resp: {str(type(resp))}")
+                    log.error(f"resp.text: {str(type(resp.text))}")
+                    log.error("Response is None, no JSON to parse")
+                    breaker.success() # the host answered, it is not down
+                    return None
+
+            # ---------- retry on bad JSON -----------------------------------------
+            except json.JSONDecodeError as jde:
+                log.error("Failed to parse JSON from %s (status %d): %s",
+                  url, resp.status_code, jde)
+
+                log.error("Response text repr: %r", resp.text)
+                traceback.print_exc()
+
+            # ---------- client errors won't go away by retrying -------------------
+            except requests.HTTPError as he:
+                if he.response.status_code < 500 and he.response.status_code != 429:
+                    log.error("safe_post: %s", he)
+                    breaker.success()
+                    return None
+                log.error("HTTPError on attempt %d: %s", attempt + 1, he)
+
+            # ---------- retry on network errors -----------------------------------
+            except requests.RequestException as re:
+                log.error("RequestException on attempt %d: %s", attempt + 1, re)
+                traceback.print_exc()
+
+            # ---------- back-off before the next loop iteration -------------------
+            if attempt == max_json_retries:
+                break
+            sleep_sec = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt)) # full jitter
+            if time.monotonic() + sleep_sec >= end:
+                return _gave_up(breaker, url, f"deadline of {deadline}s reached after {attempt + 1} attempts")
+            if not retry_budget.withdraw():
+                return _gave_up(breaker, url, f"retry budget exhausted after {attempt + 1} attempts")
+            with metrics.lock:
+                metrics.retries += 1
+            log.info("Sleeping %.2fs before retry", sleep_sec)
             time.sleep(sleep_sec)
 
-    # All retries failed
-    log.error("safe_post: gave up after %d attempts", max_json_retries + 1)
-    return None
+        # All retries failed
+        return _gave_up(breaker, url, f"{max_json_retries + 1} attempts failed")
+    except BaseException: # anything unhandled (cancellation, a decode error) still settles a half open trial
+        breaker.failure()
+        raise
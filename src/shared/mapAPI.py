@@ -2,6 +2,7 @@ import json
 import traceback
 import time
 from .http_client import safe_post
+from .async_http_client import safe_post_async
 
 
 class BackendError(Exception):
@@ -37,6 +38,9 @@ class Player:
             traceback.print_exc()
 ## MAIN CLASS ##
 
+MAP_URL = 'https://mps.geo-fs.com/map'
+MAP_PAYLOAD = {'id': '', 'gid': None}
+
 class MapAPI:
     """Client for interacting with the GeoFS map API."""
     def __init__(self):
@@ -47,7 +51,7 @@ class MapAPI:
         self._responseList = []
         self._utilizeResponseList = True
 
-    def getUsers(self, foos):
+    def getUsers(self, foos, deadline=3):
         """
         Fetch list of online users from GeoFS map endpoint.
 
@@ -56,25 +60,30 @@ class MapAPI:
                 - True:   include only users whose callsign == 'Foo'
                 - False:  exclude 'Foo' and empty callsigns
                 - None:   include all users
+            deadline (float): seconds after which the request is given up.
 
         Returns:
             list[Player] | None: Parsed Player list, or None on failure.
+                None is not an empty server, callers should skip the tick.
         """
-        payload = {'id': '', 'gid': None}
         try:
             response_body = safe_post(
-                'https://mps.geo-fs.com/map',
-                payload,
-                timeout=(5, 15),
-                max_json_retries=5,
+                MAP_URL,
+                MAP_PAYLOAD,
+                timeout=(2, 3),
+                max_json_retries=1,
+                deadline=deadline,
                 verify=False
             )
         except Exception as e:
             print(f"Error fetching users: {e}")
             traceback.print_exc()
-            return []
+            return None
         if response_body is None:
-            return []
+            return None
+        return self._parseUsers(response_body, foos)
+
+    def _parseUsers(self, response_body, foos):
         user_list = []
 
         for u in response_body.get('users', []):
@@ -99,4 +108,26 @@ class MapAPI:
 
     def enableResponseList(self):
         """Resume internally recording responses."""
-        self._utilizeResponseList = True
\ No newline at end of file
+        self._utilizeResponseList = True
+
+
+class AsyncMapAPI(MapAPI):
+    """MapAPI for asyncio code, requests go through the shared aiohttp pool."""
+    async def getUsers(self, foos, deadline=3):
+        """Same as MapAPI.getUsers without blocking the event loop."""
+        try:
+            response_body = await safe_post_async(
+                MAP_URL,
+                MAP_PAYLOAD,
+                timeout=(2, 3),
+                max_json_retries=1,
+                deadline=deadline,
+                verify=False
+            )
+        except Exception as e:
+            print(f"Error fetching users: {e}")
+            traceback.print_exc()
+            return None
+        if response_body is None:
+            return None
+        return self._parseUsers(response_body, foos)
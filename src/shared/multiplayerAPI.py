@@ -1,132 +1,131 @@
 # src/shared/multiplayerAPI.py
 
-import json
+import asyncio
 import time
-import traceback
 from .http_client import safe_post
+from .async_http_client import safe_post_async
+
+UPDATE_URL = "https://mps.geo-fs.com/update"
 
 
 class MultiplayerAPI:
-    def __init__(self, sessionID, accountID):
+    """
+    Client for the GeoFS multiplayer update endpoint.
+
+    Every call makes at most one bounded safe_post and reports failure to the
+    caller instead of retrying forever; the next poll simply tries again.
+    """
+    def __init__(self, sessionID, accountID, deadline=5):
         self.sessionID = sessionID
         self.accountID = accountID
+        self.deadline = deadline
         self.myID = None
         self.lastMsgID = None
 
-    def handshake(self):
-        """Initialize connection; populate self.myID and self.lastMsgID."""
-        while True:
-            body = {
-                "origin": "https://www.geo-fs.com",
-                "acid": self.accountID,
-                "sid": self.sessionID,
-                "id": "",
-                "ac": "1",
-                "co": [9999999999999999]*6,
-                "ve": [0.0]*6,
-                "st": {"gr": True, "as": 0},
-                "ti": int(time.time() * 1000),
-                "m": "",
-                "ci": 0
-            }
-
-            resp = safe_post(
-                "https://mps.geo-fs.com/update",
-                body,
-                timeout=(5, 15),
-                max_json_retries=2,
-                cookies={"PHPSESSID": self.sessionID}
-            )
-            if not resp:
-                print("Handshake failed, retrying in 5s…")
-                traceback.print_exc()
-                time.sleep(5)
-                continue
-
-            # first call gives us myID
-            self.myID = resp.get("myId")
-
-            # second call to pick up lastMsgId
-            body["id"] = self.myID
-            body["ci"] = self.lastMsgID
-            resp2 = safe_post(
-                "https://mps.geo-fs.com/update",
-                body,
-                timeout=(5, 15),
-                max_json_retries=2,
-                cookies={"PHPSESSID": self.sessionID}
-            )
-            if not resp2:
-                print("Second handshake call failed, retrying in 5s…")
-                traceback.print_exc()
-                time.sleep(5)
-                continue
-
-            self.myID = resp2.get("myId")
-            self.lastMsgID = resp2.get("lastMsgId")
-            return
-
-    def sendMsg(self, msg: str):
-        """Post a chat message into Geo‑FS."""
-        while True:
-            body = {
-                "origin": "https://www.geo-fs.com",
-                "acid": self.accountID,
-                "sid": self.sessionID,
-                "id": self.myID,
-                "ac": "1",
-                "co": [9999999999999999]*6,
-                "ve": [0.0]*6,
-                "st": {"gr": True, "as": 0},
-                "ti": None,
-                "m": msg,
-                "ci": self.lastMsgID
-            }
-
-            resp = safe_post(
-                "https://mps.geo-fs.com/update",
-                body,
-                timeout=(5, 15),
-                max_json_retries=2,
-                cookies={"PHPSESSID": self.sessionID}
-            )
-            if resp:
-                self.myID = resp.get("myId")
-                return
-
-            print("sendMsg failed, retrying in 5s…")
-            traceback.print_exc()
-            time.sleep(5)
-
-    def getMessages(self) -> list[dict]:
-        """Fetch latest chat messages and update self.lastMsgID."""
-        while True:
-            body = {
-                "origin": "https://www.geo-fs.com",
-                "acid": self.accountID,
-                "sid": self.sessionID,
-                "id": self.myID,
-                "ac": "1",
-                "co": [9999999999999999]*6,
-                "ve": [0.0]*6,
-                "st": {"gr": True, "as": 0},
-                "ti": None,
-                "m": "",
-                "ci": self.lastMsgID
-            }
-
-            resp = safe_post(
-                "https://mps.geo-fs.com/update",
-                body,
-                timeout=(5, 15),
-                max_json_retries=2,
-                cookies={"PHPSESSID": self.sessionID}
-            )
-            if resp:
-                self.myID = resp.get("myId")
-                self.lastMsgID = resp.get("lastMsgId")
-                return resp.get("chatMessages", [])
-
-            print("getMessages failed, retrying in 5s…")
-            traceback.print_exc()
-            time.sleep(5)
\ No newline at end of file
+    def _body(self, msg="", ti=None):
+        return {
+            "origin": "https://www.geo-fs.com",
+            "acid": self.accountID,
+            "sid": self.sessionID,
+            "id": self.myID,
+            "ac": "1",
+            "co": [9999999999999999]*6,
+            "ve": [0.0]*6,
+            "st": {"gr": True, "as": 0},
+            "ti": ti,
+            "m": msg,
+            "ci": self.lastMsgID
+        }
+
+    def _handshakeBody(self):
+        body = self._body(ti=int(time.time() * 1000))
+        body["id"] = ""
+        body["ci"] = 0
+        return body
+
+    def _post_kwargs(self):
+        return {
+            "timeout": (2, 5),
+            "max_json_retries": 2,
+            "deadline": self.deadline,
+        }
+
+    def _update(self, body):
+        return safe_post(UPDATE_URL, body, cookies={"PHPSESSID": self.sessionID}, **self._post_kwargs())
+
+    # response handling shared by both clients, each returns what the public call returns
+
+    def _onFirstHandshake(self, resp, body): # learns myID, returns the body of the second handshake call
+        if not resp:
+            print("Handshake failed.")
+            return None
+        self.myID = resp.get("myId")
+        body["id"] = self.myID
+        body["ci"] = self.lastMsgID
+        return body
+
+    def _onSecondHandshake(self, resp) -> bool:
+        if not resp:
+            print("Second handshake call failed.")
+            return False
+        self.myID = resp.get("myId")
+        self.lastMsgID = resp.get("lastMsgId")
+        return True
+
+    def _onSent(self, resp) -> bool:
+        if not resp:
+            print("sendMsg failed.")
+            return False
+        self.myID = resp.get("myId")
+        return True
+
+    def _onMessages(self, resp) -> list[dict] | None:
+        if not resp:
+            print("getMessages failed.")
+            return None
+        self.myID = resp.get("myId")
+        self.lastMsgID = resp.get("lastMsgId")
+        return resp.get("chatMessages", [])
+
+    def handshake(self) -> bool:
+        """Initialize connection; populate self.myID and self.lastMsgID. False on failure."""
+        body = self._handshakeBody()
+        body = self._onFirstHandshake(self._update(body), body)
+        return body is not None and self._onSecondHandshake(self._update(body))
+
+    def sendMsg(self, msg: str) -> bool:
+        """Post a chat message into Geo‑FS. False on failure."""
+        return self._onSent(self._update(self._body(msg)))
+
+    def getMessages(self) -> list[dict] | None:
+        """Fetch latest chat messages and update self.lastMsgID. None on failure."""
+        return self._onMessages(self._update(self._body()))
+
+
+class AsyncMultiplayerAPI(MultiplayerAPI):
+    """
+    MultiplayerAPI for asyncio code, requests go through the shared aiohttp pool.
+    Use send() to post a message, it keeps concurrent handshakes from
+    interleaving on myID and lastMsgID.
+    """
+    def __init__(self, sessionID, accountID, deadline=5):
+        super().__init__(sessionID, accountID, deadline)
+        self.lock = asyncio.Lock()
+
+    async def _update(self, body):
+        return await safe_post_async(UPDATE_URL, body, cookies={"PHPSESSID": self.sessionID}, **self._post_kwargs())
+
+    async def handshake(self) -> bool:
+        body = self._handshakeBody()
+        body = self._onFirstHandshake(await self._update(body), body)
+        return body is not None and self._onSecondHandshake(await self._update(body))
+
+    async def sendMsg(self, msg: str) -> bool:
+        return self._onSent(await self._update(self._body(msg)))
+
+    async def getMessages(self) -> list[dict] | None:
+        return self._onMessages(await self._update(self._body()))
+
+    async def send(self, msg: str) -> bool: # handshake and post a message, one caller at a time
+        async with self.lock:
+            return await self.handshake() and await self.sendMsg(msg)
@@ -0,0 +1,41 @@
+from datetime import datetime
+from pymongo import UpdateOne
+
+# Rollups are kept at these resolutions, finest first.
+RESOLUTIONS = ("minute", "hour", "day")
+
+# Bucketed series store one document per period holding a slot per bucket of the resolution.
+PERIODS = {"minute": "hour", "hour": "day", "day": "month"}
+
+def bucket_start(moment, resolution): # start of the bucket of the given resolution containing moment
+    if resolution == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if resolution == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if resolution == "day":
+        return datetime(moment.year, moment.month, moment.day)
+    if resolution == "month":
+        return datetime(moment.year, moment.month, 1)
+    raise ValueError(f"Unknown resolution {resolution}")
+
+def slot_of(moment, resolution): # position of moment's bucket inside its period document
+    return {"minute": moment.minute, "hour": moment.hour, "day": moment.day}[resolution]
+
+def slot_start(period, slot, resolution): # start of the bucket stored in a slot of a period document
+    if resolution == "minute":
+        return period.replace(minute=slot)
+    if resolution == "hour":
+        return period.replace(hour=slot)
+    return period.replace(day=slot)
+
+def slot_update(resolution, moment, samples, total, low, high): # upsert merging samples into the slot of moment in its period document
+    slot = f"slots.{slot_of(moment, resolution)}"
+    return UpdateOne(
+        {"resolution": resolution, "period": bucket_start(moment, PERIODS[resolution])},
+        {
+            "$inc": {f"{slot}.samples": samples, f"{slot}.sum": total},
+            "$min": {f"{slot}.min": low},
+            "$max": {f"{slot}.max": high},
+        },
+        upsert=True
+    )
@@ -0,0 +1,50 @@
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from collections import defaultdict
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from shared import heatmapGrid
+
+# Folds the raw player_locations points into the heatmap_cells day, month and
+# all time counters on every level.
+# Raw points carry no timestamp, the day is taken from their ObjectId. Every
+# converted chunk is deleted from player_locations right after its counters
+# are written, so an interrupted run can be started again; at worst the chunk
+# it was interrupted in is counted twice.
+
+def get_mongo_uri():
+    DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
+    DATABASE_NAME = os.getenv('DATABASE_NAME')
+    DATABASE_IP = os.getenv('DATABASE_IP')
+    DATABASE_USER = os.getenv('DATABASE_USER')
+    return f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
+
+def migrate_heatmap(db, chunk_size=50000):
+    locations = db["player_locations"]
+    cells = db["heatmap_cells"]
+    heatmapGrid.create_indexes(cells)
+
+    migrated = 0
+    while True:
+        chunk = list(locations.find({}, {"latitude": 1, "longitude": 1}).sort("_id", 1).limit(chunk_size))
+        if not chunk:
+            break
+        by_day = defaultdict(lambda: ([], []))
+        for location in chunk:
+            latitudes, longitudes = by_day[heatmapGrid.day_bucket(location["_id"].generation_time)]
+            latitudes.append(location["latitude"])
+            longitudes.append(location["longitude"])
+        ops = []
+        for day, (latitudes, longitudes) in by_day.items():
+            ops.extend(heatmapGrid.cell_updates(latitudes, longitudes, day))
+        cells.bulk_write(ops, ordered=False)
+        locations.delete_many({"_id": {"$lte": chunk[-1]["_id"]}})
+        migrated += len(chunk)
+        print(f"Migrated {migrated} player locations.")
+
+if __name__ == "__main__":
+    load_dotenv()
+    client = MongoClient(get_mongo_uri())
+    migrate_heatmap(client[os.getenv('DATABASE_NAME')])
@@ -0,0 +1,46 @@
+from pymongo import MongoClient, InsertOne
+from dotenv import load_dotenv
+import os
+
+# Moves the legacy forces.patrols arrays into the patrol_sessions collection.
+# Legacy patrols have no airspeed history, so their whole duration is counted
+# as airborne time. Patrols that were never closed are skipped.
+
+def get_mongo_uri():
+    DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
+    DATABASE_NAME = os.getenv('DATABASE_NAME')
+    DATABASE_IP = os.getenv('DATABASE_IP')
+    DATABASE_USER = os.getenv('DATABASE_USER')
+    return f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
+
+def migrate_patrols(db):
+    forces = db["forces"]
+    patrol_sessions = db["patrol_sessions"]
+
+    for force in forces.find({"patrols": {"$exists": True}}):
+        # drop anything left behind by an interrupted run before copying again
+        patrol_sessions.delete_many({"migratedFrom": force["_id"]})
+        ops = [
+            InsertOne({
+                "force": force["name"],
+                "callsign_filter": force["callsign_filter"],
+                "accountID": patrol["accountID"],
+                "callsign": patrol["callsign"],
+                "start_time": patrol["start_time"],
+                "last_seen": patrol["end_time"],
+                "end_time": patrol["end_time"],
+                "airborne_seconds": (patrol["end_time"] - patrol["start_time"]).total_seconds(),
+                "migratedFrom": force["_id"],
+            })
+            for patrol in force.get("patrols") or []
+            if patrol.get("end_time") is not None
+        ]
+        if ops:
+            patrol_sessions.bulk_write(ops, ordered=False)
+        forces.update_one({"_id": force["_id"]}, {"$unset": {"patrols": ""}})
+        print(f"Migrated {len(ops)} patrols for force {force['name']}.")
+
+if __name__ == "__main__":
+    load_dotenv()
+    client = MongoClient(get_mongo_uri())
+    migrate_patrols(client[os.getenv('DATABASE_NAME')])
@@ -0,0 +1,45 @@
+from pymongo import MongoClient
+from dotenv import load_dotenv
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from shared.timeBuckets import RESOLUTIONS, slot_update
+
+# Folds the hourly online_player_count samples into the player_counts series.
+# Every old sample becomes one sample of its minute, hour and day slots. Every
+# converted chunk is deleted from online_player_count right after its slots are
+# written, so an interrupted run can be started again; at worst the chunk it was
+# interrupted in is counted twice.
+
+def get_mongo_uri():
+    DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
+    DATABASE_NAME = os.getenv('DATABASE_NAME')
+    DATABASE_IP = os.getenv('DATABASE_IP')
+    DATABASE_USER = os.getenv('DATABASE_USER')
+    return f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
+
+def migrate_player_counts(db, chunk_size=10000):
+    samples = db["online_player_count"]
+    series = db["player_counts"]
+    series.create_index([("resolution", 1), ("period", 1)], unique=True)
+
+    migrated = 0
+    while True:
+        chunk = list(samples.find({}, {"count": 1, "datetime": 1}).sort("_id", 1).limit(chunk_size))
+        if not chunk:
+            break
+        ops = [
+            slot_update(resolution, sample["datetime"], 1, sample["count"], sample["count"], sample["count"])
+            for sample in chunk
+            for resolution in RESOLUTIONS
+        ]
+        series.bulk_write(ops, ordered=False)
+        samples.delete_many({"_id": {"$lte": chunk[-1]["_id"]}})
+        migrated += len(chunk)
+        print(f"Migrated {migrated} player count samples.")
+
+if __name__ == "__main__":
+    load_dotenv()
+    client = MongoClient(get_mongo_uri())
+    migrate_player_counts(client[os.getenv('DATABASE_NAME')])
@@ -0,0 +1,56 @@
+from pymongo import MongoClient, InsertOne
+from dotenv import load_dotenv
+import os
+import time
+
+# Moves the legacy users.events arrays into the user_events collection.
+# Safe to re-run: events already copied from a user document are replaced, and
+# the array is only unset once its events have been written.
+
+BATCH_SIZE = 1000
+
+def get_mongo_uri():
+    DATABASE_TOKEN = os.getenv('DATABASE_TOKEN')
+    DATABASE_NAME = os.getenv('DATABASE_NAME')
+    DATABASE_IP = os.getenv('DATABASE_IP')
+    DATABASE_USER = os.getenv('DATABASE_USER')
+    return f"mongodb://{DATABASE_USER}:{DATABASE_TOKEN}@{DATABASE_IP}:27017/?directConnection=true&serverSelectionTimeoutMS=2000&authSource={DATABASE_NAME}"
+
+def migrate_user_events(db):
+    users = db["users"]
+    user_events = db["user_events"]
+    user_events.create_index([("accountID", 1), ("timestamp", 1)])
+
+    pending = users.count_documents({"events": {"$exists": True}})
+    print(f"Migrating events for {pending} users...")
+
+    migrated_users = 0
+    migrated_events = 0
+    start = time.time()
+    cursor = users.find({"events": {"$exists": True}}, {"accountID": 1, "events": 1}, no_cursor_timeout=True)
+    try:
+        for user in cursor:
+            # drop anything left behind by an interrupted run before copying again,
+            # scoped by accountID so the (accountID, timestamp) index serves the lookup
+            user_events.delete_many({"accountID": user["accountID"], "migratedFrom": user["_id"]})
+            ops = [
+                InsertOne({**event, "accountID": user["accountID"], "migratedFrom": user["_id"]})
+                for event in user.get("events") or []
+            ]
+            for i in range(0, len(ops), BATCH_SIZE):
+                user_events.bulk_write(ops[i:i + BATCH_SIZE], ordered=False)
+            users.update_one({"_id": user["_id"]}, {"$unset": {"events": ""}})
+
+            migrated_users += 1
+            migrated_events += len(ops)
+            if migrated_users % 500 == 0:
+                print(f"{migrated_users}/{pending} users, {migrated_events} events ({round(time.time() - start)}s)")
+    finally:
+        cursor.close()
+
+    print(f"Done. Migrated {migrated_events} events from {migrated_users} users in {round(time.time() - start)}s.")
+
+if __name__ == "__main__":
+    load_dotenv()
+    client = MongoClient(get_mongo_uri())
+    migrate_user_events(client[os.getenv('DATABASE_NAME')])